@@ -113,6 +113,10 @@ class Trueno():
         return MessageToDict(self.backend.StopModelOnBackend(
             backend_pb2.Backend(bhash=backend_id)))
 
+    def reload_backend(self, backend_id, model_hash, password="", privatekey=""):
+        return MessageToDict(self.backend.ReloadModelOnBackend(
+            backend_pb2.Backend(bhash=backend_id, mhash=model_hash, mcode=password, mpvtk=privatekey)))
+
     def list_backend_outlet(self, backend_id):
         pass_in = {'bid': backend_id}
         return MessageToDict(self.backend.ListOutlets(ParseDict(pass_in, backend_pb2.Outlet())))
@@ -360,6 +364,73 @@ class Trueno():
             data = image.read()
         return MessageToDict(self._compute_image(compute_id, backend_id, data, extra_data, 0))
 
+    def async_compute_frame(self, compute_id, backend_id, frame):
+        """Sends a decoded frame (uint8 HWC or float32) without re-encoding it
+        """
+        dtype = 1 if frame.dtype.name == 'uint8' else 2
+        if dtype == 2 and frame.dtype.name != 'float32':
+            frame = frame.astype('float32')
+        extra = json.dumps({'shape': list(frame.shape)})
+        return MessageToDict(self._compute_image(compute_id, backend_id, frame.tobytes(), extra, dtype))
+
+    def sync_compute_image(self, compute_id, backend_id, image_path, extra_data=None, timeout=None):
+        """Inferences an image and returns its result instead of posting it to outlets
+        """
+        data = b''
+        with open(image_path, "rb") as image:
+            data = image.read()
+        return MessageToDict(self.inference.InferSync(inference_pb2.InferRequest(
+            bid=backend_id,
+            uuid=compute_id,
+            data=data,
+            extra=extra_data,
+            dtype=0,
+        ), timeout=timeout))
+
+    def batch_compute_images(self, backend_id, image_paths, timeout=None):
+        """Inferences images in one call, returns results in the order of `image_paths`
+        """
+        item_list = []
+        for path in image_paths:
+            with open(path, "rb") as image:
+                item_list.append(inference_pb2.InferRequest(uuid=str(uuid.uuid4()), data=image.read()))
+        return MessageToDict(self.inference.InferBatch(inference_pb2.BatchRequest(
+            bid=backend_id,
+            items=item_list,
+        ), timeout=timeout))
+
+    def fanout_compute_image(self, compute_id, backend_ids, image_path, extra_data=None, timeout=None):
+        """Inferences an image on several backends in parallel, e.g. in multiple mode
+        """
+        data = b''
+        with open(image_path, "rb") as image:
+            data = image.read()
+        return MessageToDict(self.inference.InferFanout(inference_pb2.FanoutRequest(
+            bids=backend_ids,
+            uuid=compute_id,
+            data=data,
+            extra=extra_data,
+            dtype=0,
+        ), timeout=timeout))
+
+    def stream_compute_frames(self, backend_id, frames):
+        """Inferences an iterable of `(compute_id, frame)`, yields results as they are ready
+        """
+        def requests():
+            for compute_id, frame in frames:
+                dtype = 1 if frame.dtype.name == 'uint8' else 2
+                if dtype == 2 and frame.dtype.name != 'float32':
+                    frame = frame.astype('float32')
+                yield inference_pb2.InferRequest(
+                    bid=backend_id,
+                    uuid=compute_id,
+                    data=frame.tobytes(),
+                    extra=json.dumps({'shape': list(frame.shape)}),
+                    dtype=dtype,
+                )
+        for reply in self.inference.InferStream(requests()):
+            yield MessageToDict(reply)
+
     def _compute_image(self, compute_id, backend_id, data, extra, dtype):
         return self.inference.InferenceRemote(inference_pb2.InferRequest(
             bid=backend_id,
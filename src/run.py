@@ -9,6 +9,7 @@
 import os
 import sys
 import time
+import atexit
 import signal
 import logging
 import argparse
@@ -19,7 +20,7 @@ from serving.core import debug
 from serving.core import config
 from serving.core import backend
 from serving.core import runtime
-from serving.core.memory import FEATURE_GATE, BACKEND, PLUGIN
+from serving.core.memory import FEATURE_GATE, BACKEND, PLUGIN, IMAGES_POOL, RESULT_CACHE
 
 # force protobuf to use cpp-implementation
 os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'cpp'
@@ -97,6 +98,9 @@ if __name__ == "__main__":
     logging.getLogger('').setLevel(logging.INFO)
     config.load_configs_from_disk(config_path=args.conf)
     logging.debug(config.list_all_configs({'client': 'internal'}))
+    IMAGES_POOL.set_budget(config.lim_max_frame_store_bytes())
+    atexit.register(IMAGES_POOL.clear)
+    RESULT_CACHE.set_budget(config.lim_max_result_cache_entries(), config.lim_max_result_cache_bytes())
 
     # ignore child processes' signal
     signal.signal(signal.SIGCHLD, signal.SIG_IGN)
@@ -15,9 +15,13 @@ import signal
 import hashlib
 import logging
 import importlib
+import threading
+import numpy as np
+from concurrent import futures
 from enum import Enum, unique
 from shutil import copyfile, rmtree
-from multiprocessing import Process, Queue, Value
+from multiprocessing import Array, Condition, Lock, Process, Queue, SimpleQueue, Value
+from multiprocessing.connection import wait
 
 from serving.core import debug
 from serving.core import model
@@ -27,7 +31,20 @@ from serving.core import sandbox
 from serving.core import exception
 from serving.core import regulator
 from serving.core import scheduler
-from serving.core.memory import FEATURE_GATE, IMAGES_POOL, PLUGIN, OUTLET_FACTORY
+from serving.core.memory import FEATURE_GATE, IMAGES_POOL, PLUGIN, OUTLET_FACTORY, RESULT_CACHE
+
+# seconds between two load samples of autoscaling
+SCALE_INTERVAL = 1.0
+# seconds between two polls of new compute processes while swapping models,
+# and of forked compute processes while joining them
+SWAP_POLL = 0.1
+JOIN_POLL = 0.05
+# seconds between two checks of the watchdog, and most seconds it waits
+# before respawning a process which keeps failing
+WATCH_INTERVAL = 1.0
+RESPAWN_BACKOFF_MAX = 60.0
+# environment variables of thread pools, read by libraries as they load
+THREAD_ENVS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
 
 
 class AbstractBackend(metaclass=abc.ABCMeta):
@@ -36,9 +53,22 @@ class AbstractBackend(metaclass=abc.ABCMeta):
     All specific Backend Class inherit from this abstract Class
 
     """
+    # whether a loaded model can be forked into compute processes, i.e. its
+    # runtime starts no threads and holds no device contexts, see `prefork`
+    PREFORK = False
+
     def __init__(self, configurations):
         self.task_queue = Queue()
         self.result_queue = Queue()
+        # results of synchronous tasks, demultiplexed to waiters by reply id, as
+        # (reply id, json result or None, cache key, whether result is cacheable)
+        self.reply_queue = Queue()
+        self.waiters = {}
+        self.waiters_lock = threading.Lock()
+        self.demuxer = None
+        # requests coalesced into in-flight tasks, by key of their data
+        self.flights = {}
+        self.flights_lock = threading.Lock()
         self.configs = {
             'btype': configurations.get('btype'),
             'storage': configurations.get('storage'),
@@ -58,11 +88,89 @@ class AbstractBackend(metaclass=abc.ABCMeta):
         if self.configs.get('preheat') is None:
             self.configs['preheat'] = config.preheat()
         self.backend_hash = AbstractBackend._gen_hash(self.configs)
+        self.options = AbstractBackend._load_options(self.configs['configs'])
+        if self.options['prefork'] and not self.PREFORK:
+            logging.warning("%s does not support prefork, each compute process loads its model",
+                            type(self).__name__)
+            self.options['prefork'] = False
+
+        # initiate admission control of task queue
+        self.queue_cond = Condition()
+        self.enqueue_lock = Lock()
+        self.queue_depth = Value('Q', 0, lock=False)
+        self.queue_bytes = Value('Q', 0, lock=False)
+        self.queue_rejected = Value('Q', 0, lock=False)
+        self.queue_dropped = Value('Q', 0, lock=False)
+        self.queue_expired = Value('Q', 0, lock=False)
+        # total seconds dequeued tasks waited in queue, and their count
+        self.queue_waited = Value('d', 0.0, lock=False)
+        self.queue_taken = Value('Q', 0, lock=False)
 
-        # initiate compute process objects
-        self.cproc = [None] * self.configs['cpcount']
+        # per-tenant accounting, tenants without weight or rate share slot 0
+        self.tenant_names = [''] + sorted(
+            (set(self.options['tenant_weights']) | set(self.options['tenant_rates'])) - set(['', '*']))
+        self.tenant_queued = Array('Q', len(self.tenant_names), lock=False)
+        self.tenant_done = Array('Q', len(self.tenant_names), lock=False)
+        self.tenant_throttled = {}
+        self.tenant_buckets = {}
+        self.tenant_lock = threading.Lock()
+        self.tenant_snapshot = (time.time(), [0] * len(self.tenant_names))
+
+        # initiate compute process objects, in slots up to `max_cpcount` if autoscaled;
+        # a second half of slots hosts the processes of the next model, see `reload`
+        self.slots = self.configs['cpcount']
+        if self.options['autoscale']:
+            self.slots = max(self.slots, self.options['max_cpcount'])
+        self.slot_base = 0
+        # half of slots whose processes read the task queue, without `dispatcher`
+        self.serving_half = Value('B', 0, lock=False)
+        self.generation = 0
+        self.swapping = False
+        self.swap_lock = threading.RLock()
+        slots = 2 * self.slots
+        self.cproc = [None] * slots
         self.cproc_sync_state = Value('B', Status.Unloaded.value)
-        self.cproc_self_state = [Value('B', Status.Unloaded.value)] * self.configs['cpcount']
+        self.cproc_self_state = [Value('B', Status.Unloaded.value) for _ in range(slots)]
+        # channels and in-flight batches of compute processes, see `_dispatch_loop`
+        self.cproc_queue = [None] * slots
+        self.cproc_inflight = [Value('Q', 0, lock=False) for _ in range(slots)]
+        # seconds compute processes waited for tasks, and since when they wait
+        self.cproc_idle = [Value('d', 0.0, lock=False) for _ in range(slots)]
+        self.cproc_idle_since = [Value('d', 0.0, lock=False) for _ in range(slots)]
+        # CPUs and thread budget of each process slot, shared by both halves
+        self.cpu_layout = self._cpu_layout(self.slots)
+        # heartbeats, restarts and tasks held of compute processes, which
+        # report tickets of tasks they take and finish through `ledger`, see
+        # `_watchdog_loop`; its writes are synchronous, so reports are not lost
+        # with a crash. Tasks are kept by ticket in `tickets` once queued.
+        self.cproc_beat = [Value('d', 0.0, lock=False) for _ in range(slots)]
+        self.cproc_ran = [Value('B', 0, lock=False) for _ in range(slots)]
+        self.tickets = {}
+        self.owner_pid = os.getpid()
+        self.cproc_restarts = [0] * slots
+        self.cproc_failures = [0] * slots
+        self.cproc_respawn_at = [0.0] * slots
+        self.cproc_held = [{} for _ in range(slots)]
+        self.ledger = SimpleQueue()
+        self.watch_exit = None
+        self.watchdog = None
+        # template processes of both halves of slots, and pids of the compute
+        # processes they fork, see `_template_loop`
+        self.template = [None, None]
+        self.template_control = [None, None]
+        self.cproc_pid = [Value('i', 0, lock=False) for _ in range(slots)]
+        self.cproc_exited = [Value('B', 0, lock=False) for _ in range(slots)]
+        # see `_autoscale_loop`
+        self.scale_exit = None
+        self.scaler = None
+        self.retiring = 0
+        self.scale_stats = {}
+        self.dispatch_cond = Condition()
+        self.dispatch_exit = None
+        self.dispatcher = None
+        self.process_idx = None
+        # set while stopping, no more tasks are admitted
+        self.draining = False
 
         # initiate model object
         split = self.configs['mhash'].split('-')
@@ -73,6 +181,8 @@ class AbstractBackend(metaclass=abc.ABCMeta):
         self.model_predp = None
         self.model_postdp = None
         self.copy_folder = None
+        # created by each compute process on its first batch
+        self.sample_pool = None
 
         # initiate outlet objects
         self.outlets = []
@@ -89,8 +199,8 @@ class AbstractBackend(metaclass=abc.ABCMeta):
 
     def report(self):
         compute_status = []
-        for cs in self.cproc_self_state:
-            compute_status.append(cs.value)
+        for i in self._generation_slots():
+            compute_status.append(self.cproc_self_state[i].value)
         return {
             'bhash': self.backend_hash,
             'btype': self.configs['btype'],
@@ -105,8 +215,97 @@ class AbstractBackend(metaclass=abc.ABCMeta):
             'configs': self.configs['configs'],
             'persist': config.exist_persist_work(self.backend_hash),
             'cpstatus': compute_status,
+            'stats': json.dumps(self._stats()),
+            'cpulayout': json.dumps(self.cpu_layout),
+        }
+
+    def _stats(self):
+        return {
+            'queue': {
+                'depth': self.queue_depth.value,
+                'bytes': self.queue_bytes.value,
+                'max_depth': self.options['max_queue_depth'],
+                'max_bytes': self.options['max_queue_bytes'],
+                'rejected': self.queue_rejected.value,
+                'dropped': self.queue_dropped.value,
+                'expired': self.queue_expired.value,
+            },
+            'inflight': [v.value for v in self.cproc_inflight],
+            'autoscale': self.scale_stats,
+            'restarts': self.cproc_restarts,
+            'generation': self.generation,
+            'swapping': self.swapping,
+            'tenants': self._tenant_stats(),
+            'cache': RESULT_CACHE.usage(),
+            'flights': len(self.flights),
         }
 
+    def _tenant_stats(self):
+        now, done = time.time(), list(self.tenant_done)
+        stamp, last_done = self.tenant_snapshot
+        self.tenant_snapshot = (now, done)
+        stats = {}
+        for idx, name in enumerate(self.tenant_names):
+            stats[name or '*'] = {
+                'queued': self.tenant_queued[idx],
+                'done': done[idx],
+                'done_per_sec': round((done[idx] - last_done[idx]) / max(now - stamp, 1e-3), 2),
+                'throttled': self.tenant_throttled.get(name, 0),
+            }
+        return stats
+
+    def _cpu_layout(self, slots):
+        """Splits `cpu_set` into consecutive shares of process slots, slots
+        share CPUs round-robin if there are fewer CPUs than slots
+
+        Returns a list of {'cpus': [...], 'threads': n, 'pinned': bool}.
+        """
+        cpus = sorted(self.options['cpu_set'])
+        if not cpus:
+            if hasattr(os, 'sched_getaffinity'):
+                cpus = sorted(os.sched_getaffinity(0))
+            else:
+                cpus = list(range(os.cpu_count() or 1))
+        layout = []
+        for i in range(slots):
+            share = cpus[i * len(cpus) // slots:(i + 1) * len(cpus) // slots]
+            if not share:
+                share = [cpus[i % len(cpus)]]
+            layout.append({
+                'cpus': share,
+                'threads': len(share) if self.options['thread_budget'] else 0,
+                'pinned': self.options['cpu_affinity'],
+            })
+        return layout
+
+    def _apply_cpu_layout(self, process_idx):
+        """Pins this compute process and limits its thread pools, by its slot
+        of `cpu_layout`
+        """
+        layout = self.cpu_layout[process_idx % self.slots]
+        if layout['pinned']:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, layout['cpus'])
+            else:
+                logging.warning("cpu_affinity is not supported on this platform")
+        if not layout['threads']:
+            return
+        for env in THREAD_ENVS:
+            os.environ[env] = str(layout['threads'])
+        try:
+            import cv2
+            cv2.setNumThreads(layout['threads'])
+        except ImportError:
+            pass
+        logging.debug("iproc-%d runs on cpus %s with %d thread(s)", process_idx, layout['cpus'], layout['threads'])
+
+    def _thread_budget(self):
+        """Intra-op threads of this compute process, 0 means unlimited
+        """
+        if self.process_idx is None:
+            return 0
+        return self.cpu_layout[self.process_idx % self.slots]['threads']
+
     @staticmethod
     def _gen_hash(configs):
         hash_string = "{}{}{}{}{}{}{}{}{}{}".format(
@@ -123,59 +322,486 @@ class AbstractBackend(metaclass=abc.ABCMeta):
         )
         return 'B'+hashlib.md5(hash_string.encode('utf-8')).hexdigest()
 
+    @staticmethod
+    def _load_options(configs):
+        """Parses backend options from the JSON `configs` of a backend
+        """
+        if not configs:
+            options = {}
+        elif isinstance(configs, dict):
+            options = dict(configs)
+        else:
+            try:
+                options = json.loads(configs)
+            except ValueError:
+                raise exception.ParamValidationError(": configs is not a valid json")
+        if not isinstance(options, dict):
+            raise exception.ParamValidationError(": configs is not a json object")
+        regulator.backend_options(options)
+        return options
+
+    def _new_batcher(self, input_queue, track=False, central=False):
+        # weighted fair queuing of the dispatcher sees all queued tasks, not only
+        # the first ones; a batcher of each compute process keeps the default
+        # window, so it does not pull the whole shared queue away from the others
+        window = None
+        if self.options['tenant_weights'] and central:
+            window = 0
+        return scheduler.Batcher(input_queue, self.configs['batchsize'], delay=self._batch_delay(),
+                                 window=window, weights=self.options['tenant_weights'], track=track)
+
+    def _batch_delay(self):
+        if self.options['max_batch_delay_ms'] is None:
+            return None
+        return self.options['max_batch_delay_ms'] / 1000.0
+
     @debug.flow("ab.run")
     @regulator.if_feature_on_run(FEATURE_GATE['on_authorized'], runtime.validate_device)
     def run(self):
         self.stop()
+        self._purge_sentinels()
         # loading
-        self.model_configs = model._load_model_configs({'mhash': self.configs['mhash']})
-        # TODO: add test of multiple backend loaded with difference pre/post
-        sys.path.append(self.model_filepath)
-        self.model_predp = importlib.import_module('pre_dataprocess')
-        self.model_predp = importlib.reload(self.model_predp)
-        self.model_postdp = importlib.import_module('post_dataprocess')
-        self.model_postdp = importlib.reload(self.model_postdp)
-        sys.path.remove(self.model_filepath)
+        self._install_model(self._load_model_bundle({
+            'mhash': self.configs['mhash'],
+            'mcode': self.configs['mcode'],
+            'mpvtk': self.configs['mpvtk'],
+        }))
         # start compute process
-        for i in range(self.configs['cpcount']):
-            self.cproc[i] = Process(
-                target=self._predict_loop,
-                args=(i, self.cproc_sync_state, self.cproc_self_state[i], self.task_queue,))
-            self.cproc[i].daemon = True
-            self.cproc[i].start()
+        count = self.configs['cpcount']
+        if self.options['autoscale']:
+            count = min(max(count, self.options['min_cpcount']), self.options['max_cpcount'])
+        self.serving_half.value = self.slot_base // self.slots
+        for i in range(count):
+            self._start_process(self.slot_base + i)
         self.cproc_sync_state.value = Status.Running.value
+        if self.options['dispatcher']:
+            self.dispatch_exit = threading.Event()
+            self.dispatcher = threading.Thread(target=self._dispatch_loop, args=(self.dispatch_exit,), daemon=True)
+            self.dispatcher.start()
+        if self.options['watchdog']:
+            self.watch_exit = threading.Event()
+            self.watchdog = threading.Thread(target=self._watchdog_loop, args=(self.watch_exit,), daemon=True)
+            self.watchdog.start()
+        if self.options['autoscale']:
+            self.scale_exit = threading.Event()
+            self.scaler = threading.Thread(target=self._autoscale_loop, args=(self.scale_exit,), daemon=True)
+            self.scaler.start()
+        self.draining = False
         return {'code': 0, 'msg': self.backend_hash}
 
-    @debug.flow("ab._predict_loop")
+    def _load_model_bundle(self, spec):
+        """Loads configs and data processing modules of the model `spec` gives
+        by mhash, mcode and mpvtk, for `_install_model`
+        """
+        split = spec['mhash'].split('-')
+        filepath = os.path.join(self.configs['storage'], "models", split[0], split[1])
+        # TODO: add test of multiple backend loaded with difference pre/post
+        sys.path.append(filepath)
+        try:
+            predp = importlib.reload(importlib.import_module('pre_dataprocess'))
+            postdp = importlib.reload(importlib.import_module('post_dataprocess'))
+        finally:
+            sys.path.remove(filepath)
+        return {
+            'spec': spec,
+            'configs': model._load_model_configs({'mhash': spec['mhash']}),
+            'filepath': filepath,
+            'predp': predp,
+            'postdp': postdp,
+        }
+
+    def _install_model(self, loaded):
+        self.configs.update(loaded['spec'])
+        self.model_configs = loaded['configs']
+        self.model_filepath = loaded['filepath']
+        self.model_predp = loaded['predp']
+        self.model_postdp = loaded['postdp']
+
+    @debug.flow("ab.reload")
+    def reload(self, spec):
+        """Swaps the model of the backend for the one `spec` gives by mhash,
+        mcode and mpvtk, without downtime
+
+        New compute processes load and preheat the model in the spare half of
+        process slots while the current ones keep serving. Once all of them
+        run, the backend is switched over to them at once, and the current
+        processes drain the tasks they hold like on `stop`. Without
+        `dispatcher`, the current processes get their `None` through the task
+        queue, which is shared with stream works, and new processes read it
+        only once all of them got it, see `_hand_over`. If a new process
+        fails or does not run within `swap_timeout_ms`, the new processes are
+        stopped and the current model keeps serving. A stopped backend simply
+        runs the model.
+        """
+        with self.swap_lock:
+            if self.cproc_sync_state.value != Status.Running.value:
+                self._install_model(self._load_model_bundle(spec))
+                return self.run()
+            blue = list(self._generation_slots())
+            green_base = self.slots - self.slot_base
+            green = range(green_base, green_base + self.slots)
+            for i in green:
+                if self.cproc[i] is not None and self.cproc[i].is_alive():
+                    raise exception.ReloadModelOnBackendError(": previous model is still draining")
+                self.cproc[i] = None
+            self._stop_template(green_base // self.slots)
+            count = self.configs['cpcount']
+            if self.options['autoscale']:
+                count = min(max(self._live_processes(), self.options['min_cpcount']), self.options['max_cpcount'])
+            green = green[:count]
+            self.swapping = True
+            try:
+                for i in green:
+                    self._start_process(i, spec=spec)
+                self._wait_running(green, time.time() + self.options['swap_timeout_ms'] / 1000.0)
+                loaded = self._load_model_bundle(spec)
+            except Exception:
+                for i in green:
+                    if self.cproc[i] is not None:
+                        self.cproc[i].terminate()
+                        self.cproc[i].join()
+                    self.cproc[i] = None
+                    self.cproc_queue[i] = None
+                self._stop_template(green_base // self.slots)
+                self.swapping = False
+                raise
+            # switch over
+            with self.enqueue_lock:
+                with self.dispatch_cond:
+                    self._install_model(loaded)
+                    self.slot_base = green_base
+                    if self.options['dispatcher']:
+                        for i in blue:
+                            if self.cproc[i] is not None and \
+                                self.cproc_self_state[i].value == Status.Running.value:
+                                self.cproc_self_state[i].value = Status.Exited.value
+                                self.cproc_queue[i].put(None)
+                    else:
+                        alive = len([i for i in blue if self.cproc[i] is not None and self.cproc[i].is_alive()])
+                        for _ in range(alive - self.retiring):
+                            self.task_queue.put(None)
+                        self.retiring = 0
+                    self.generation += 1
+                    self.dispatch_cond.notify_all()
+            if not self.options['dispatcher']:
+                self._hand_over(blue, green_base // self.slots)
+            self.swapping = False
+            logging.info("backend %s runs model %s", self.backend_hash, spec['mhash'])
+            self._drain_slots(blue)
+        return {'code': 0, 'msg': self.backend_hash}
+
+    def _hand_over(self, slots, half):
+        """Lets processes of `half` read the task queue, once processes of
+        `slots` have read their `None` from it
+
+        A process which does not read it within `drain_timeout_ms` (e.g. it
+        failed) is drained first, and `None`s left are removed, so processes of
+        `half` never read one meant for the previous model.
+        """
+        deadline = time.time() + self.options['drain_timeout_ms'] / 1000.0
+        while time.time() < deadline:
+            if all([self.cproc[i] is None or self.cproc_self_state[i].value == Status.Exited.value
+                    for i in slots]):
+                self.serving_half.value = half
+                return
+            time.sleep(SWAP_POLL)
+        self._drain_slots(slots)
+        self._purge_sentinels()
+        self.serving_half.value = half
+
+    def _wait_running(self, slots, deadline):
+        # raises once any process of `slots` fails, or they do not run by `deadline`
+        while True:
+            states = [self.cproc_self_state[i].value for i in slots]
+            if all([s == Status.Running.value for s in states]):
+                return
+            for i in slots:
+                if self.cproc_self_state[i].value > Status.Running.value or \
+                    self.cproc[i] is None or not self.cproc[i].is_alive():
+                    raise exception.ReloadModelOnBackendError(": iproc-{} failed to load".format(i))
+            if time.time() > deadline:
+                raise exception.ReloadModelOnBackendError(": model is not running in time")
+            time.sleep(SWAP_POLL)
+
+    def _drain_slots(self, slots):
+        """Waits for processes of `slots`, which got a `None`, to drain, then
+        moves tasks they left behind to the task queue
+
+        With `watchdog`, terminated and failed ones are left to the watchdog,
+        which re-queues the tasks they hold.
+        """
+        deadline = time.time() + self.options['drain_timeout_ms'] / 1000.0
+        for i in slots:
+            if self.cproc[i] is not None:
+                self.cproc[i].join(max(deadline - time.time(), 0))
+        left = []
+        for i in slots:
+            proc = self.cproc[i]
+            if proc is None:
+                continue
+            if proc.is_alive():
+                logging.warning("iproc-%s is not drained in time, terminate it", i)
+                proc.terminate()
+                proc.join()
+            if self.options['watchdog'] and self.cproc_self_state[i].value != Status.Exited.value:
+                continue
+            self.cproc[i] = None
+            if self.cproc_queue[i] is not None:
+                while True:
+                    try:
+                        batch = self.cproc_queue[i].get_nowait()
+                    except queue.Empty:
+                        break
+                    if batch is not None:
+                        left.extend(batch)
+                self.cproc_queue[i] = None
+        if left:
+            self._requeue_tasks(left)
+            logging.warning("move %d task(s) left behind to the task queue", len(left))
+        self._stop_template(slots[0] // self.slots)
+
+    def _generation_slots(self):
+        # process slots of the current model
+        return range(self.slot_base, self.slot_base + self.slots)
+
+    def _start_process(self, i, spec=None):
+        """Starts compute process of slot `i`, on model `spec` if it is given
+
+        With `prefork`, the process is forked by the template process of its
+        half of slots, which is started first if needed.
+        """
+        input_queue = self.task_queue
+        half = i // self.slots
+        if self.options['prefork']:
+            self._start_template(half, input_queue, spec)
+        elif self.options['dispatcher']:
+            self.cproc_queue[i] = Queue()
+        if self.options['dispatcher']:
+            input_queue = self.cproc_queue[i]
+        self.cproc_inflight[i].value = 0
+        self.cproc_idle[i].value = 0.0
+        self.cproc_idle_since[i].value = 0.0
+        self.cproc_beat[i].value = 0.0
+        self.cproc_ran[i].value = 0
+        self.cproc_held[i] = {}
+        self.cproc_self_state[i].value = Status.Unloaded.value
+        if self.options['prefork']:
+            self.cproc_pid[i].value = 0
+            self.cproc_exited[i].value = 0
+            self.cproc[i] = ForkedProcess(i, self.template[half], self.template_control[half],
+                                          self.cproc_pid[i], self.cproc_exited[i])
+        else:
+            self.cproc[i] = ReapedProcess(
+                target=self._predict_loop,
+                args=(i, self.cproc_sync_state, self.cproc_self_state[i], input_queue, spec,))
+        self.cproc[i].daemon = True
+        self.cproc[i].start()
+
+    def _start_template(self, half, input_queue, spec):
+        if self.template[half] is not None and self.template[half].is_alive():
+            return
+        self._stop_template(half)
+        if self.options['dispatcher']:
+            # channels are inherited by the template, and reused by respawns
+            for i in range(half * self.slots, (half + 1) * self.slots):
+                if self.cproc_queue[i] is None:
+                    self.cproc_queue[i] = Queue()
+        self.template_control[half] = Queue()
+        self.template[half] = ReapedProcess(
+            target=self._template_loop,
+            args=(half, self.template_control[half], input_queue, spec,))
+        self.template[half].daemon = True
+        self.template[half].start()
+
+    def _stop_template(self, half):
+        # an idle template holds nothing, and its forked processes outlive it
+        if self.template[half] is None:
+            return
+        self.template[half].terminate()
+        self.template[half].join()
+        self.template[half] = None
+        self.template_control[half] = None
+
+    @debug.flow("ab._template_loop")
     @regulator.if_feature_on_run(FEATURE_GATE['on_authorized'], runtime.validate_device)
-    def _predict_loop(self, process_idx, sync_status, load_status, input_queue):
+    def _template_loop(self, half, control, input_queue, spec):
+        """Loads the model once, then forks a compute process for each slot
+        index read from `control`, with `prefork`
+
+        Forked processes share the loaded model copy-on-write, instead of each
+        copying and loading their own. The template reports their pids through
+        `cproc_pid`, reaps them and reports their exits through `cproc_exited`,
+        and terminates them on request, so a reused pid is never signaled.
+        """
+        # inherited from the main process, which lets the kernel reap its children
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
         try:
-            # loading model object
-            load_status.value = Status.Loading.value
-            is_load_completed = False
-            copy_folder_name = "process_{}".format(process_idx)
-            self.copy_folder = os.path.join(self.model_filepath, copy_folder_name)
-            os.mkdir(self.copy_folder)
-            if FEATURE_GATE['on_sandbox'] and self.configs['mcode'] != "":
-                sandbox.decode_model(
-                    self.configs['mcode'], self.configs['mpvtk'],
-                    self.model_filepath, self.model_filename, copy_folder_name + "/model_dore")
-            else:
-                copyfile(os.path.join(self.model_filepath, 'model_dore'),
-                         os.path.join(self.copy_folder, 'model_dore'))
-                logging.warning("loaded a model WITHOUT encryption")
-            self.model_filename = "model_dore"
+            if spec is not None:
+                self._install_model(self._load_model_bundle(spec))
+            self._load_model_object("template_{}".format(half))
+        except Exception as err:
+            # processes waiting for it fail as it exits
+            logging.error("template-%d failed to load model: %s", half, err)
+            if config.debug_option():
+                logging.exception(err)
+            return
+        logging.debug("template-%d loaded model %s", half, self.configs['mhash'])
+        children = {}
+        while True:
+            self._reap_children(children)
             try:
-                # TODO(): still exist leaking risks
-                is_loaded_param = self._load_model()
+                command, i = control.get(timeout=JOIN_POLL)
+            except queue.Empty:
+                continue
+            if command == 'terminate':
+                for pid, idx in children.items():
+                    if idx == i:
+                        os.kill(pid, signal.SIGTERM)
+                continue
+            pid = os.fork()
+            if pid != 0:
+                children[pid] = i
+                self.cproc_pid[i].value = pid
+                continue
+            if self.options['dispatcher']:
+                input_queue = self.cproc_queue[i]
+            try:
+                self._predict_loop(i, self.cproc_sync_state, self.cproc_self_state[i], input_queue,
+                                   preloaded=True)
             finally:
-                rmtree(self.copy_folder)
+                # flushes results, as the process exits without finalizers
+                for output_queue in [self.reply_queue, self.result_queue]:
+                    output_queue.close()
+                    output_queue.join_thread()
+                os._exit(0)
+
+    def _reap_children(self, children):
+        # reaps exited processes forked by the template, see `_template_loop`
+        while children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            i = children.pop(pid, None)
+            if i is not None:
+                self.cproc_exited[i].value = 1
 
+    def _autoscale_loop(self, exit_event):
+        """Adds or retires compute processes by the load of the backend
 
-            if self.model_object is None:
-                raise exception.ReloadModelOnBackendError()
-            if not is_load_completed:
-                self._load_parameter()
+        Samples queue depth, average queue wait and utilization of processes
+        every second for `scheduler.Autoscaler`. A new process takes tasks only
+        after it has loaded and preheated its model. A retired process gets a
+        `None` like on `stop`, so it finishes the tasks it holds first.
+        """
+        scaler = scheduler.Autoscaler(
+            self.options['min_cpcount'], self.options['max_cpcount'],
+            self.options['scale_up_wait_ms'] / 1000.0, self.options['scale_down_busy'],
+            self.options['scale_cooldown_ms'] / 1000.0)
+        last = self._load_sample()
+        while not exit_event.wait(SCALE_INTERVAL):
+            if self.swapping:
+                # samples the new processes after the swap
+                last = None
+                continue
+            if last is None:
+                last = self._load_sample()
+                continue
+            self._reap_processes()
+            sample = self._load_sample()
+            elapsed = max(sample[0] - last[0], 1e-3)
+            running = len([i for i in self._generation_slots()
+                           if self.cproc_self_state[i].value == Status.Running.value])
+            busy = 0.0
+            if running:
+                busy = max(0.0, 1.0 - (sample[1] - last[1]) / (elapsed * running))
+            taken = sample[3] - last[3]
+            depth = self.queue_depth.value
+            if taken:
+                wait = (sample[2] - last[2]) / taken
+            else:
+                # nothing is dequeued, queued tasks waited all along
+                wait = elapsed if depth else 0.0
+            last = sample
+            count = self._live_processes()
+            self.scale_stats = {
+                'processes': count,
+                'busy': round(busy, 3),
+                'wait_ms': round(wait * 1000.0, 1),
+            }
+            step = scaler.decide(count, depth, wait, busy)
+            free = [i for i in self._generation_slots() if self.cproc[i] is None]
+            if step > 0 and free:
+                idx = free[0]
+                logging.info("autoscale: add iproc-%d to %d process(es)", idx, count)
+                self._start_process(idx)
+            elif step < 0:
+                logging.info("autoscale: retire one of %d process(es)", count)
+                self._retire_process()
+
+    def _load_sample(self):
+        now = time.time()
+        idle = 0.0
+        for i in self._generation_slots():
+            idle += self.cproc_idle[i].value
+            if self.cproc_idle_since[i].value:
+                idle += max(now - self.cproc_idle_since[i].value, 0.0)
+        return (now, idle, self.queue_waited.value, self.queue_taken.value)
+
+    def _live_processes(self):
+        slots = self._generation_slots()
+        if self.options['dispatcher']:
+            return len([i for i in slots if self.cproc[i] is not None and
+                        self.cproc_self_state[i].value != Status.Exited.value])
+        return len([i for i in slots if self.cproc[i] is not None]) - self.retiring
+
+    def _retire_process(self):
+        if not self.options['dispatcher']:
+            # whichever process takes it exits
+            with self.enqueue_lock:
+                self.retiring += 1
+                self.task_queue.put(None)
+            return
+        candidates = [i for i in self._generation_slots() if self.cproc[i] is not None and
+                      self.cproc_self_state[i].value == Status.Running.value]
+        if not candidates:
+            return
+        idx = min(candidates, key=lambda i: self.cproc_inflight[i].value)
+        # no more batches are dispatched to it
+        self.cproc_self_state[idx].value = Status.Exited.value
+        self.cproc_queue[idx].put(None)
+
+    def _reap_processes(self):
+        # frees slots of exited processes
+        for i in self._generation_slots():
+            proc = self.cproc[i]
+            if proc is None or proc.is_alive():
+                continue
+            if self.cproc_self_state[i].value != Status.Exited.value:
+                if self.options['watchdog']:
+                    # to be respawned
+                    continue
+                logging.warning("iproc-%d exited with status %d", i, self.cproc_self_state[i].value)
+            elif not self.options['dispatcher'] and self.retiring > 0:
+                self.retiring -= 1
+            proc.join()
+            self.cproc[i] = None
+
+    @debug.flow("ab._predict_loop")
+    @regulator.if_feature_on_run(FEATURE_GATE['on_authorized'], runtime.validate_device)
+    def _predict_loop(self, process_idx, sync_status, load_status, input_queue, spec=None, preloaded=False):
+        try:
+            self.process_idx = process_idx
+            self._apply_cpu_layout(process_idx)
+            if spec is not None:
+                # the next model, which the main process switches to later
+                self._install_model(self._load_model_bundle(spec))
+            # loading model object, unless forked from a template which has loaded it
+            load_status.value = Status.Loading.value
+            if not preloaded:
+                self._load_model_object("process_{}".format(process_idx))
             # preheat
             if self.configs.get('preheat') is not None:
                 load_status.value = Status.Preheating.value
@@ -185,35 +811,28 @@ class AbstractBackend(metaclass=abc.ABCMeta):
                 ret = PLUGIN['reader'].read_image({'source': self.configs['preheat']})
                 if ret is None:
                     raise exception.ReloadModelOnBackendError(": preheat image returns None")
-                IMAGES_POOL[img_uuid] = PLUGIN['reader'].read_image({'source': self.configs['preheat']})
+                IMAGES_POOL[img_uuid] = ret
                 preheat_task = scheduler.Task(task_id="preheat_{}".format(process_idx), image_id=img_uuid)
                 self.infer_data([preheat_task], 1)
+                self._free_frame(preheat_task)
                 logging.debug("iproc-%d preheated", process_idx)
 
-            # predicting loop
+            # predicting loop, until a `None` is queued by `stop`
             load_status.value = Status.Running.value
-            while True:
-                idx = -1
-                task_list = [None] * self.configs['batchsize']
-                while idx < self.configs['batchsize']-1:
-                    try:
-                        task = input_queue.get(timeout=0.5)
-                        idx = idx + 1
-                        task_list[idx] = task
-                    except queue.Empty:
-                        logging.debug("check status: %s", sync_status)
-                        if sync_status.value == Status.Exited.value:
-                            break
-                        logging.debug("fetch timeout: %s, got %s", self.configs['batchsize'], idx+1)
-
-                if sync_status.value == Status.Exited.value:
-                    break
-                idx = -1
-                logging.debug("iproc-%d get %d task(s)", process_idx, self.configs['batchsize'])
-                result_list = self.infer_data(task_list, self.configs['batchsize'])
-                logging.debug("raw result: %s", result_list)
-                for idx in range(self.configs['batchsize']):
-                    self._finish_task(task_list[idx], result_list[idx])
+            self.cproc_ran[process_idx].value = 1
+            if self.options['dispatcher']:
+                batcher = scheduler.Channel(input_queue)
+                with self.dispatch_cond:
+                    self.dispatch_cond.notify_all()
+            else:
+                # processes of the next model wait until the current ones stopped reading, see `reload`
+                while self.serving_half.value != process_idx // self.slots:
+                    time.sleep(SWAP_POLL)
+                batcher = self._new_batcher(input_queue, track=self.options['watchdog'])
+            if self.options['pipeline']:
+                self._pipeline_loop(process_idx, batcher)
+            else:
+                self._serial_loop(process_idx, batcher)
             load_status.value = Status.Exited.value
         except Exception as err:
             # capture all possible exceptions
@@ -231,22 +850,573 @@ class AbstractBackend(metaclass=abc.ABCMeta):
             else:
                 load_status.value = Status.Error.value
 
+    def _load_model_object(self, copy_folder_name):
+        # copies or decrypts the model into a folder of this process, and loads it
+        is_load_completed = False
+        self.copy_folder = os.path.join(self.model_filepath, copy_folder_name)
+        os.mkdir(self.copy_folder)
+        if FEATURE_GATE['on_sandbox'] and self.configs['mcode'] != "":
+            sandbox.decode_model(
+                self.configs['mcode'], self.configs['mpvtk'],
+                self.model_filepath, self.model_filename, copy_folder_name + "/model_dore")
+        else:
+            copyfile(os.path.join(self.model_filepath, 'model_dore'),
+                     os.path.join(self.copy_folder, 'model_dore'))
+            logging.warning("loaded a model WITHOUT encryption")
+        self.model_filename = "model_dore"
+        try:
+            # TODO(): still exist leaking risks
+            is_loaded_param = self._load_model()
+        finally:
+            rmtree(self.copy_folder)
+
+
+        if self.model_object is None:
+            raise exception.ReloadModelOnBackendError()
+        if not is_load_completed:
+            self._load_parameter()
+
+    def _watchdog_loop(self, exit_event):
+        """Supervises compute processes by their heartbeats and held tasks
+
+        A process which exited with an error (e.g. one bad frame crashed its
+        model), died, or holds tasks without finishing any for
+        `hang_timeout_ms` is killed and reported to `_ledger_loop`, which
+        re-queues its tasks and respawns it. A process which failed before it
+        ran (e.g. a bad model or labels) is left in error, not respawned.
+        """
+        reader = threading.Thread(target=self._ledger_loop, daemon=True)
+        reader.start()
+        while not exit_event.wait(WATCH_INTERVAL):
+            now = time.time()
+            for i, proc in enumerate(self.cproc):
+                if proc is None:
+                    continue
+                if proc.is_alive():
+                    if not self.cproc_held[i] or \
+                        now - self.cproc_beat[i].value < self.options['hang_timeout_ms'] / 1000.0:
+                        continue
+                    logging.warning("iproc-%d is hung, kill it", i)
+                    proc.terminate()
+                elif self.cproc_self_state[i].value == Status.Exited.value:
+                    continue
+                elif not self.cproc_ran[i].value:
+                    if self.cproc_self_state[i].value not in [Status.Error.value, Status.Error_labels.value]:
+                        self.cproc_self_state[i].value = Status.Error.value
+                        logging.error("iproc-%d failed to load its model", i)
+                    continue
+                if self.cproc_self_state[i].value != Status.Error.value:
+                    # no more batches are dispatched to it
+                    self.cproc_self_state[i].value = Status.Error.value
+                    logging.warning("iproc-%d has failed", i)
+                proc.join(WATCH_INTERVAL)
+                if proc.is_alive():
+                    # not terminated yet, checked again next time
+                    continue
+                # behind all reports of the process
+                self.ledger.put(('failed', i, proc.pid))
+        self.ledger.put(None)
+        reader.join()
+
+    def _ledger_loop(self):
+        """Keeps the tasks each compute process holds from its reports in
+        `ledger`, and recovers failed processes in order with those reports
+        """
+        while True:
+            message = self.ledger.get()
+            if message is None:
+                break
+            kind, idx, items = message
+            held = self.cproc_held[idx]
+            if kind == 'take':
+                # tasks from the task queue, or a dispatched (released) batch
+                tickets, dispatched = items
+                for ticket in tickets:
+                    if isinstance(ticket, scheduler.Task):
+                        # queued by another process, e.g. a stream work
+                        self.tickets[ticket.ticket] = ticket
+                        ticket = ticket.ticket
+                    held[ticket] = [dispatched, dispatched]
+            elif kind == 'run':
+                for ticket in items:
+                    if ticket in held:
+                        held[ticket] = [True, True]
+            elif kind == 'done':
+                for ticket in items:
+                    held.pop(ticket, None)
+                    self.tickets.pop(ticket, None)
+                self.cproc_failures[idx] = 0
+            elif kind == 'failed' and self.cproc[idx] is not None and \
+                    self.cproc[idx].pid == items and not self.cproc[idx].is_alive():
+                self._recover_process(idx)
+
+    def _recover_process(self, i):
+        self._recover_tasks(i)
+        if i not in self._generation_slots():
+            # of the previous or the next model, see `reload`
+            self.cproc[i] = None
+            return
+        now = time.time()
+        if now < self.cproc_respawn_at[i] or self.draining:
+            # reported again by the next check
+            return
+        self.cproc_restarts[i] += 1
+        self.cproc_failures[i] += 1
+        self.cproc_respawn_at[i] = now + min(RESPAWN_BACKOFF_MAX, 2.0 ** self.cproc_failures[i])
+        logging.warning("respawn iproc-%d, %d restart(s)", i, self.cproc_restarts[i])
+        self._start_process(i)
+
+    def _recover_tasks(self, i):
+        """Re-queues tasks held by failed process `i`, including batches still
+        in its channel, and fails running ones which exceed `max_task_retries`
+        """
+        recovered = []
+        for ticket, (released, running) in self.cproc_held[i].items():
+            task = self.tickets.pop(ticket, None)
+            if task is not None:
+                recovered.append([task, released, running])
+        self.cproc_held[i] = {}
+        if self.cproc_queue[i] is not None:
+            while True:
+                try:
+                    batch = self.cproc_queue[i].get_nowait()
+                except queue.Empty:
+                    break
+                if batch is not None:
+                    recovered.extend([[task, True, False] for task in batch])
+        if not recovered:
+            return
+        # tasks not released yet are still counted as queued
+        self._release_tasks([task for task, released, _ in recovered if not released])
+        retry_list = []
+        for task, _, running in recovered:
+            if task.image_id is not None and task.image_id not in IMAGES_POOL:
+                # finished, its frame was freed before it was reported
+                continue
+            if running:
+                task.retries += 1
+            if task.retries > self.options['max_task_retries'] or self.draining:
+                self._fail_task(task)
+            else:
+                retry_list.append(task)
+        if not retry_list:
+            return
+        logging.warning("re-queue %d task(s) of iproc-%d", len(retry_list), i)
+        self._requeue_tasks(retry_list)
+
+    def _requeue_tasks(self, task_list):
+        # puts released tasks back into the task queue
+        self._track_tasks(task_list)
+        with self.queue_cond:
+            self.queue_depth.value += len(task_list)
+            self.queue_bytes.value += sum([t.nbytes for t in task_list])
+            for task in task_list:
+                self.tenant_queued[self._tenant_slot(task.tenant)] += 1
+        with self.enqueue_lock:
+            for task in task_list:
+                self.task_queue.put(task, block=False)
+
+    def _track_tasks(self, task_list):
+        # keeps tasks to re-queue by ticket, so processes report tickets only
+        if not self.options['watchdog'] or os.getpid() != self.owner_pid:
+            return
+        for task in task_list:
+            task.tracked = True
+            self.tickets[task.ticket] = task
+
+    def _ledger_tickets(self, task_list):
+        # tickets of tasks in the main process, and others as they are
+        return [task.ticket if task.tracked else task for task in task_list]
+
+    def _fail_task(self, task):
+        logging.error("task(%s) fails, its compute process failed", task.task_id)
+        err = exception.ComputeProcessError()
+        self.tickets.pop(task.ticket, None)
+        self._free_frame(task)
+        if task.reply_id is not None:
+            future = self.forget_task(task)
+            if future is not None:
+                future.set_exception(err)
+        if task.reply_id is None or task.post_outlets:
+            self.post_result(task, json.dumps({'error': err.message}))
+        if task.cache_key is not None:
+            self._land_flight(task.cache_key, None, err)
+
+    def _settle_tasks(self, task_list):
+        # reports tasks which are finished by this compute process
+        self.cproc_beat[self.process_idx].value = time.time()
+        if self.options['watchdog'] and task_list:
+            self.ledger.put(('done', self.process_idx, [t.ticket for t in task_list]))
+
+    def _next_tasks(self, batcher):
+        """Returns the next batch of decoded tasks, or None once stopped
+        """
+        since = time.time()
+        self.cproc_idle_since[self.process_idx].value = since
+        task_list = batcher.next_batch()
+        self.cproc_idle_since[self.process_idx].value = 0.0
+        self.cproc_idle[self.process_idx].value += time.time() - since
+        # beats before it reports the tasks taken
+        self.cproc_beat[self.process_idx].value = time.time()
+        if self.options['watchdog']:
+            if self.options['dispatcher']:
+                if task_list:
+                    self.ledger.put(('take', self.process_idx, (self._ledger_tickets(task_list), True)))
+            else:
+                fresh = batcher.take_fresh()
+                if fresh:
+                    self.ledger.put(('take', self.process_idx, (self._ledger_tickets(fresh), False)))
+        if not self.options['dispatcher'] and batcher.stopped:
+            # it reads no more tasks, the next model may take them, see `_hand_over`
+            self.cproc_self_state[self.process_idx].value = Status.Exited.value
+        if task_list is None:
+            return None
+        if not self.options['dispatcher']:
+            self._release_tasks(task_list)
+            if self.options['watchdog']:
+                self.ledger.put(('run', self.process_idx, [t.ticket for t in task_list]))
+        task_list = self._decode_tasks(self._drop_expired(task_list))
+        if not task_list:
+            self._batch_done()
+        return task_list
+
+    def _drop_expired(self, task_list):
+        """Drops tasks whose deadline has passed, before they take inference
+        slots, and fails their waiters with timeout
+        """
+        now = time.time()
+        alive_list = []
+        for task in task_list:
+            if not task.expired(now):
+                alive_list.append(task)
+                continue
+            logging.warning("task(%s) is expired before inference", task.task_id)
+            if task.image_id is not None:
+                try:
+                    del IMAGES_POOL[task.image_id]
+                except KeyError:
+                    pass
+            if task.reply_id is not None or task.cache_key is not None:
+                self.reply_queue.put((task.reply_id, None, task.cache_key, False))
+            with self.queue_cond:
+                self.queue_expired.value += 1
+        if len(alive_list) < len(task_list):
+            self._settle_tasks([t for t in task_list if t not in alive_list])
+        return alive_list
+
+    def _dispatch_loop(self, exit_event):
+        """Forms batches centrally and sends each to the least busy compute process
+
+        A process holds at most `_stage_buffers()` + 1 batches, so it never idles
+        while its next batch is ready, and the other tasks stay in the task
+        queue under its admission control.
+        """
+        batcher = self._new_batcher(self.task_queue, central=True)
+        limit = self._stage_buffers() + 1
+        while True:
+            with self.dispatch_cond:
+                while self._least_busy_process(limit) is None:
+                    if exit_event.is_set():
+                        return
+                    self.dispatch_cond.wait()
+            task_list = batcher.next_batch()
+            if task_list is None:
+                break
+            self._release_tasks(task_list)
+            with self.dispatch_cond:
+                idx = self._least_busy_process()
+                self.cproc_inflight[idx].value += 1
+            self.cproc_queue[idx].put(task_list)
+        # the task queue is drained, so are compute processes
+        for channel in self.cproc_queue:
+            if channel is not None:
+                channel.put(None)
+
+    def _least_busy_process(self, limit=None):
+        """Returns the running process with the fewest batches in flight, below
+        `limit` if it is given
+        """
+        candidates = [i for i in self._generation_slots()
+                      if self.cproc_self_state[i].value == Status.Running.value]
+        if limit is not None:
+            candidates = [i for i in candidates if self.cproc_inflight[i].value < limit]
+        elif not candidates:
+            candidates = [i for i in self._generation_slots() if self.cproc_queue[i] is not None]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: self.cproc_inflight[i].value)
+
+    def _batch_done(self):
+        if not self.options['dispatcher']:
+            return
+        with self.dispatch_cond:
+            inflight = self.cproc_inflight[self.process_idx]
+            inflight.value -= min(1, inflight.value)
+            self.dispatch_cond.notify_all()
+
+    def _serial_loop(self, process_idx, batcher):
+        while True:
+            task_list = self._next_tasks(batcher)
+            if task_list is None:
+                break
+            if not task_list:
+                continue
+            logging.debug("iproc-%d get %d task(s)", process_idx, len(task_list))
+            result_list = self.infer_data(task_list, len(task_list))
+            logging.debug("raw result: %s", result_list)
+            self._finish_tasks(task_list, result_list)
+
+    def _pipeline_loop(self, process_idx, batcher):
+        """Overlaps the stages of consecutive batches
+
+        A prepare thread builds batch N+1 and a process thread finishes batch
+        N-1, while this thread computes batch N. Stages hand off batches through
+        queues of one slot, and the first error of any stage stops the
+        pipeline and is raised here, after tasks of the batches in it fail.
+        The batcher is halted by the error, so no more batches are taken, and
+        the tasks not taken yet stay queued.
+        """
+        prepared = queue.Queue(maxsize=1)
+        computed = queue.Queue(maxsize=1)
+        errors = []
+
+        def fail(err):
+            errors.append(err)
+            batcher.halt()
+
+        def abort(task_list):
+            try:
+                self._finish_tasks(task_list, [{'error': "batch is aborted by a failed stage"}] * len(task_list))
+            except Exception as err:
+                logging.error("iproc-%d failed to abort %d task(s): %s", process_idx, len(task_list), err)
+
+        def prepare():
+            try:
+                while not errors:
+                    task_list = self._next_tasks(batcher)
+                    if task_list is None:
+                        break
+                    if not task_list:
+                        continue
+                    logging.debug("iproc-%d get %d task(s)", process_idx, len(task_list))
+                    prepared.put((task_list, self._prepare_batch(task_list, len(task_list))))
+            except Exception as err:
+                fail(err)
+            finally:
+                prepared.put(None)
+
+        def process():
+            item = None
+            try:
+                item = computed.get()
+                while item is not None:
+                    self._finish_tasks(item[0], self._process_batch(item[1]))
+                    item = computed.get()
+            except Exception as err:
+                fail(err)
+                abort(item[0])
+                item = computed.get()
+                while item is not None:
+                    abort(item[0])
+                    item = computed.get()
+
+        stages = [threading.Thread(target=prepare, daemon=True),
+                  threading.Thread(target=process, daemon=True)]
+        for t in stages:
+            t.start()
+        try:
+            item = prepared.get()
+            while item is not None:
+                if errors:
+                    abort(item[0])
+                else:
+                    computed.put((item[0], self._compute_batch(item[1])))
+                item = prepared.get()
+        except Exception as err:
+            fail(err)
+            abort(item[0])
+            item = prepared.get()
+            while item is not None:
+                abort(item[0])
+                item = prepared.get()
+        computed.put(None)
+        for t in stages:
+            t.join()
+        if errors:
+            raise errors[0]
+
+    def _finish_tasks(self, task_list, result_list):
+        for idx, task in enumerate(task_list):
+            self._finish_task(task, result_list[idx])
+        with self.queue_cond:
+            for task in task_list:
+                self.tenant_done[self._tenant_slot(task.tenant)] += 1
+        self._settle_tasks(task_list)
+        self._batch_done()
+
     @debug.flow("ab._finish_task")
     def _finish_task(self, task, result):
         logging.debug("prepare to send task(%s)'s result: %s", task, result)
+        # errors (e.g. a damaged image) reach coalesced requests, but are not cached
+        cacheable = not (isinstance(result, dict) and 'error' in result)
+        result = json.dumps(result)
+        if task.reply_id is not None or task.cache_key is not None:
+            self.reply_queue.put((task.reply_id, result, task.cache_key, cacheable))
+        if self.options['watchdog']:
+            # kept for a retry until the task is finished
+            self._free_frame(task)
+        if task.reply_id is not None and not task.post_outlets:
+            return
+        self.post_result(task, result)
+
+    def post_result(self, task, result):
+        """Posts json `result` of `task` to all outlets
+        """
         for o in self.outlets:
-            o.post_result(task, json.dumps(result))
+            o.post_result(task, result)
+
+    def _decode_tasks(self, task_list):
+        """Decodes tasks which carry compressed images, inside compute process
+
+        Tasks with damaged images are finished with an error result right away,
+        and are removed from the returned list.
+        """
+        decoded_list = []
+        for task in task_list:
+            if task.payload is not None:
+                task.frame = PLUGIN['reader'].read_buffer({'source': task.payload})
+                task.payload = None
+                if task.frame is None:
+                    logging.error("task(%s) carries a damaged image", task.task_id)
+                    self._finish_task(task, {'error': "image is damaged"})
+                    self._settle_tasks([task])
+                    continue
+            decoded_list.append(task)
+        return decoded_list
+
+    def _take_frame(self, task):
+        """Returns the image frame of `task` and frees it from IMAGES_POOL,
+        with `watchdog` only once the task is finished
+
+        With the shared-memory frame store, the frame is a zero-copy view which
+        stays valid until it is garbage collected.
+        """
+        if task.frame is not None:
+            frame, task.frame = task.frame, None
+            return frame
+        if self.options['watchdog']:
+            return IMAGES_POOL[task.image_id]
+        return IMAGES_POOL.pop(task.image_id)
 
     @debug.flow("ab.stop")
     def stop(self):
-        self.cproc_sync_state.value = Status.Exited.value
-        time.sleep(2)  # wait for predicting while-loop exit
-        for i in range(self.configs['cpcount']):
-            if self.cproc[i] is not None:
-                logging.debug("iproc-%s status: %s", i, self.cproc[i].is_alive())
-                self.cproc[i].terminate()
-                logging.debug("terminate iproc-%s", i)
-        return {'code': 0, 'msg': self.backend_hash}
+        """Stops admission, drains accepted tasks, then stops compute processes
+
+        A `None` queued behind all accepted tasks stops each compute process
+        (or the dispatcher, which passes it on), so processes exit as soon as
+        the queue is drained. Processes still alive after `drain_timeout_ms`
+        are terminated, and tasks left behind are discarded.
+        """
+        with self.swap_lock:
+            if self.scaler is not None:
+                self.scale_exit.set()
+                self.scaler.join()
+                self.scaler = None
+            with self.enqueue_lock:
+                self.draining = True
+                if self.dispatcher is not None and self.dispatcher.is_alive():
+                    self.task_queue.put(None)
+                elif self.dispatcher is None:
+                    # retiring processes have got theirs, and ones exited since
+                    # reaping are still counted as retiring
+                    self._reap_processes()
+                    alive, retired = 0, 0
+                    for i, proc in enumerate(self.cproc):
+                        if proc is None:
+                            continue
+                        if proc.is_alive():
+                            alive += 1
+                        elif self.cproc_self_state[i].value == Status.Exited.value:
+                            retired += 1
+                    for _ in range(alive - max(0, self.retiring - retired)):
+                        self.task_queue.put(None)
+            deadline = time.time() + self.options['drain_timeout_ms'] / 1000.0
+            if self.dispatcher is not None:
+                self.dispatcher.join(max(deadline - time.time(), 0))
+            for i in range(len(self.cproc)):
+                if self.cproc[i] is not None:
+                    self.cproc[i].join(max(deadline - time.time(), 0))
+            if self.watchdog is not None:
+                self.watch_exit.set()
+                self.watchdog.join()
+                self.watchdog = None
+            self.cproc_sync_state.value = Status.Exited.value
+            if self.dispatch_exit is not None:
+                self.dispatch_exit.set()
+                with self.dispatch_cond:
+                    self.dispatch_cond.notify_all()
+            terminated = False
+            for i in range(len(self.cproc)):
+                if self.cproc[i] is not None and self.cproc[i].is_alive():
+                    logging.warning("iproc-%s is not drained in time, terminate it", i)
+                    self.cproc[i].terminate()
+                    self.cproc[i].join()
+                    terminated = True
+                self.cproc[i] = None
+            self._stop_template(0)
+            self._stop_template(1)
+            for i in range(len(self.cproc)):
+                if self.cproc_held[i]:
+                    logging.warning("discard %d task(s) held by iproc-%d", len(self.cproc_held[i]), i)
+                    for ticket, (released, _) in self.cproc_held[i].items():
+                        task = self.tickets.get(ticket)
+                        if task is None:
+                            continue
+                        if not released:
+                            self._release_tasks([task])
+                        self._discard_task(task)
+                    self.cproc_held[i] = {}
+            self.dispatcher = None
+            self.retiring = 0
+            if terminated:
+                self._purge_queues()
+            # left by processes which exited without reporting them
+            self.tickets = {}
+            # channels hold the `None` of the dispatcher, and are renewed on run
+            self.cproc_queue = [None] * len(self.cproc)
+            return {'code': 0, 'msg': self.backend_hash}
+
+    def _purge_queues(self):
+        # discards tasks which are left behind by terminated processes
+        purged = []
+        for input_queue in [self.task_queue] + [q for q in self.cproc_queue if q is not None]:
+            while True:
+                try:
+                    item = input_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, scheduler.Task):
+                    self._release_tasks([item])
+                    purged.append(item)
+                elif item is not None:
+                    purged.extend(item)
+        for task in purged:
+            self._discard_task(task)
+        if purged:
+            logging.warning("discard %d task(s) left behind", len(purged))
+
+    def _purge_sentinels(self):
+        # removes `None`s left by `stop` or retired processes which exited first
+        left = []
+        while True:
+            try:
+                item = self.task_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                left.append(item)
+        for task in left:
+            self.task_queue.put(task, block=False)
 
     @debug.flow("ab.enable_persist")
     def enable_persist(self):
@@ -259,7 +1429,289 @@ class AbstractBackend(metaclass=abc.ABCMeta):
     # TODO: let task own a outlet_id
     @debug.flow("ab.enqueue_task")
     def enqueue_task(self, task):
-        self.task_queue.put(task, block=False)
+        """Admits `task` into the task queue
+
+        Once the queue reaches `max_queue_depth` or `max_queue_bytes`, sheds
+        load by `shed_policy`: `reject` the given task, `drop_oldest` queued
+        task, or `block` until there is room or `block_timeout_ms` is over.
+        Raises BackendOverloadError if the given task is shed.
+        """
+        self.enqueue_tasks([task])
+
+    @debug.flow("ab.enqueue_tasks")
+    def enqueue_tasks(self, task_list):
+        """Admits all tasks of `task_list` or none of them, like `enqueue_task`
+
+        Admitted tasks are put into the task queue next to each other, so they
+        are likely to be computed in the same batches. With `coalesce` option,
+        tasks whose data is in flight already are not queued at all.
+        """
+        if self.draining:
+            raise exception.BackendDrainingError()
+        task_list = self._board_flights(task_list)
+        if not task_list:
+            return
+        policy = self.options['shed_policy']
+        timeout = 0
+        if policy == 'block':
+            timeout = self.options['block_timeout_ms'] / 1000.0
+        while not self._admit_tasks(task_list, timeout):
+            if policy == 'drop_oldest' and self._drop_oldest_task():
+                continue
+            for task in task_list:
+                self._discard_task(task)
+            with self.queue_cond:
+                self.queue_rejected.value += len(task_list)
+            raise exception.BackendOverloadError()
+        if any([task.cache_key is not None for task in task_list]):
+            with self.waiters_lock:
+                self._start_demuxer()
+        with self.enqueue_lock:
+            if self.draining:
+                self._release_tasks(task_list)
+                for task in task_list:
+                    self._discard_task(task)
+                raise exception.BackendDrainingError()
+            self._track_tasks(task_list)
+            for task in task_list:
+                self.task_queue.put(task, block=False)
+
+    @debug.flow("ab.submit_task")
+    def submit_task(self, task):
+        """Enqueues `task` and returns a future of its result
+
+        The result skips outlets, compute processes send it back through
+        `reply_queue`, and the demultiplexer thread resolves the future waiting
+        for its reply id.
+        """
+        return self.submit_tasks([task])[0]
+
+    @debug.flow("ab.submit_tasks")
+    def submit_tasks(self, task_list):
+        """Enqueues `task_list` atomically and returns futures of their results
+        """
+        future_list = []
+        with self.waiters_lock:
+            self._start_demuxer()
+            for task in task_list:
+                task.reply_id = str(uuid.uuid4())
+                future_list.append(futures.Future())
+                self.waiters[task.reply_id] = future_list[-1]
+        try:
+            self.enqueue_tasks(task_list)
+        except exception.TruenoException:
+            for task in task_list:
+                self.forget_task(task)
+            raise
+        return future_list
+
+    def forget_task(self, task):
+        """Stops waiting for the result of `task`, e.g. its caller timed out
+        """
+        with self.waiters_lock:
+            return self.waiters.pop(task.reply_id, None)
+
+    def in_flight(self, key):
+        """Whether a task with `key` is in flight and may be joined
+        """
+        if not self.options['coalesce'] or key is None:
+            return False
+        with self.flights_lock:
+            return self._flight_alive(key)
+
+    def _flight_alive(self, key):
+        # with flights_lock held, a flight whose leader is lost (e.g. its
+        # compute process is gone) is taken over by the next task
+        flight = self.flights.get(key)
+        if flight is None:
+            return False
+        return time.time() - flight[0] < self.options['sync_timeout_ms'] / 1000.0
+
+    def _board_flights(self, task_list):
+        """Attaches tasks to in-flight tasks with the same key, returns the
+        others, which lead new flights
+        """
+        if not self.options['coalesce']:
+            return task_list
+        leader_list = []
+        with self.flights_lock:
+            for task in task_list:
+                if task.cache_key is None:
+                    leader_list.append(task)
+                elif self._flight_alive(task.cache_key):
+                    self.flights[task.cache_key][1].append(task)
+                    self._free_frame(task)
+                else:
+                    followers = self.flights.get(task.cache_key, (0, []))[1]
+                    self.flights[task.cache_key] = (time.time(), followers)
+                    leader_list.append(task)
+        return leader_list
+
+    def _land_flight(self, key, result, err=None):
+        """Delivers `result` of a flight to all tasks attached to it, or fails
+        them with `err` (by default timeout) if there is no result
+        """
+        with self.flights_lock:
+            flight = self.flights.pop(key, None)
+        if flight is None:
+            return
+        for task in flight[1]:
+            if task.reply_id is None:
+                if result is not None:
+                    self.post_result(task, result)
+                continue
+            future = self.forget_task(task)
+            if future is None:
+                continue
+            if result is None:
+                future.set_exception(err or exception.InferTimeOutError())
+                continue
+            future.set_result(result)
+
+    def _start_demuxer(self):
+        # with waiters_lock held
+        if self.demuxer is None:
+            self.demuxer = threading.Thread(target=self._demux_loop, daemon=True)
+            self.demuxer.start()
+
+    def _demux_loop(self):
+        while True:
+            reply_id, result, cache_key, cacheable = self.reply_queue.get()
+            if cache_key is not None:
+                if cacheable:
+                    RESULT_CACHE.put(cache_key, result)
+                self._land_flight(cache_key, result)
+            if reply_id is None:
+                continue
+            with self.waiters_lock:
+                future = self.waiters.pop(reply_id, None)
+            if future is None:
+                logging.debug("drop reply(%s) without waiter", reply_id)
+                continue
+            if result is None:
+                future.set_exception(exception.InferTimeOutError())
+                continue
+            future.set_result(result)
+
+    def _admit_tasks(self, task_list, timeout=0):
+        deadline = time.time() + timeout
+        nbytes = sum([t.nbytes for t in task_list])
+        with self.queue_cond:
+            while not self._queue_fits(nbytes, len(task_list)):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.queue_cond.wait(remaining)
+            self.queue_depth.value += len(task_list)
+            self.queue_bytes.value += nbytes
+            for task in task_list:
+                self.tenant_queued[self._tenant_slot(task.tenant)] += 1
+            return True
+
+    def wait_for_room(self, timeout):
+        """Waits until the task queue has room for another task
+
+        Returns False if there is still no room after `timeout` seconds.
+        """
+        deadline = time.time() + timeout
+        with self.queue_cond:
+            while not self._queue_fits(0):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.queue_cond.wait(remaining)
+            return True
+
+    def stream_window(self):
+        """Number of tasks a stream may keep in flight
+        """
+        if self.options['stream_window']:
+            return self.options['stream_window']
+        return 2 * self.configs['batchsize']
+
+    def _queue_fits(self, nbytes, count=1):
+        # tasks larger than the limits are still admitted into empty queue
+        max_depth = self.options['max_queue_depth']
+        if max_depth and self.queue_depth.value > 0 and \
+            self.queue_depth.value + count > max_depth:
+            return False
+        max_bytes = self.options['max_queue_bytes']
+        if max_bytes and self.queue_depth.value > 0 and \
+            self.queue_bytes.value + nbytes > max_bytes:
+            return False
+        return True
+
+    def _release_tasks(self, task_list):
+        now = time.time()
+        with self.queue_cond:
+            self.queue_waited.value += sum([now - t.timestamp for t in task_list])
+            self.queue_taken.value += len(task_list)
+            self.queue_depth.value -= min(len(task_list), self.queue_depth.value)
+            nbytes = sum([t.nbytes for t in task_list])
+            self.queue_bytes.value -= min(nbytes, self.queue_bytes.value)
+            for task in task_list:
+                slot = self._tenant_slot(task.tenant)
+                self.tenant_queued[slot] -= min(1, self.tenant_queued[slot])
+            self.queue_cond.notify_all()
+
+    def _tenant_slot(self, tenant):
+        try:
+            return self.tenant_names.index(tenant)
+        except ValueError:
+            return 0
+
+    def take_token(self, tenant):
+        """Takes a token from the bucket of `tenant`, by `tenant_rates` option
+
+        Returns False and counts the tenant as throttled if it exceeds its rate.
+        """
+        rates = self.options['tenant_rates']
+        rate = rates.get(tenant, rates.get('*'))
+        if rate is None:
+            return True
+        with self.tenant_lock:
+            bucket = self.tenant_buckets.get(tenant)
+            if bucket is None:
+                bucket = scheduler.TokenBucket(rate)
+                self.tenant_buckets[tenant] = bucket
+            if bucket.take():
+                return True
+            self.tenant_throttled[tenant] = self.tenant_throttled.get(tenant, 0) + 1
+            return False
+
+    def _drop_oldest_task(self):
+        try:
+            task = self.task_queue.get_nowait()
+        except queue.Empty:
+            return False
+        if task is None:
+            # a process is stopping or retiring, which keeps its `None`
+            self.task_queue.put(None, block=False)
+            return False
+        logging.warning("task queue is full, drop the oldest task(%s)", task.task_id)
+        self._release_tasks([task])
+        self._discard_task(task)
+        with self.queue_cond:
+            self.queue_dropped.value += 1
+        return True
+
+    def _discard_task(self, task):
+        self.tickets.pop(task.ticket, None)
+        self._free_frame(task)
+        if task.reply_id is not None:
+            future = self.forget_task(task)
+            if future is not None:
+                future.set_exception(exception.BackendOverloadError())
+        if task.cache_key is not None:
+            self._land_flight(task.cache_key, None, exception.BackendOverloadError())
+
+    def _free_frame(self, task):
+        if task.image_id is not None:
+            try:
+                del IMAGES_POOL[task.image_id]
+            except KeyError:
+                pass
+            task.image_id = None
 
     @debug.flow("ab.dequeue_result")
     def dequeue_result(self):
@@ -301,7 +1753,6 @@ class AbstractBackend(metaclass=abc.ABCMeta):
     def _load_parameter(self):
         raise NotImplementedError()
 
-    @debug.timeout(60)
     def infer_data(self, task_list, batchsize):
         return self._infer_data(task_list, batchsize)
 
@@ -309,6 +1760,172 @@ class AbstractBackend(metaclass=abc.ABCMeta):
     def _infer_data(self, task_list, batchsize):
         raise NotImplementedError()
 
+    def _preprocess_samples(self, task_list, batchsize, sample_input):
+        """Runs `pre_dataprocess` on each sample of a batch, returns outputs in
+        order
+
+        `sample_input(i, task, frame)` builds the input of the i-th sample.
+        Samples are preprocessed in parallel when `preprocess_threads` is set.
+        A bundle with `pre_dataprocess_batch` is called once per batch instead.
+        """
+        if hasattr(self.model_predp, 'pre_dataprocess_batch'):
+            return self._preprocess_batch(task_list, batchsize)
+
+        def prepare(i):
+            task = task_list[i]
+            return self.model_predp.pre_dataprocess(sample_input(i, task, self._take_frame(task)))
+        return self._map_samples(prepare, batchsize)
+
+    def _preprocess_batch(self, task_list, batchsize):
+        """Calls `pre_dataprocess_batch` once with all frames of a batch
+
+        Frames of the same shape are stacked into one array as `imgs`, along
+        with `extras` of tasks. The bundle returns `feed_list` with each batched
+        feed stacked along its first axis and one `passby` for each sample,
+        which are split into outputs of samples without copying. A feed which
+        is not batched, see `_feed_batched`, is given to each sample as it is.
+        """
+        frames = self._map_samples(lambda i: self._take_frame(task_list[i]), batchsize)
+        if len(set([(f.shape, f.dtype) for f in frames])) == 1:
+            frames = np.stack(frames)
+        predp = self.model_predp.pre_dataprocess_batch({
+            'imgs': frames,
+            'extras': [task.extra for task in task_list[:batchsize]],
+        })
+        batched = [self._feed_batched(j) for j in range(len(predp['feed_list']))]
+        return [{
+            'feed_list': [feed[i] if batched[j] else feed for j, feed in enumerate(predp['feed_list'])],
+            'passby': predp['passby'][i],
+        } for i in range(batchsize)]
+
+    def _feed_batched(self, index):
+        # whether the `index`-th input of the model is stacked by samples
+        return True
+
+    def _postprocess_samples(self, batchsize, post_frame):
+        """Runs `post_dataprocess` on each sample of a batch, returns results in
+        order
+
+        `post_frame(i)` builds the input of the i-th sample, and `post_frame(None)`
+        the input of the whole batch, which is given to `post_dataprocess_batch`
+        of a bundle once instead, and which returns one result for each sample.
+        """
+        if hasattr(self.model_postdp, 'post_dataprocess_batch'):
+            return list(self.model_postdp.post_dataprocess_batch(post_frame(None)))
+        return [self.model_postdp.post_dataprocess(post_frame(i)) for i in range(batchsize)]
+
+    def _map_samples(self, func, count):
+        """Calls `func` on 0 to `count`-1 by the preprocessing pool of this
+        compute process, or one by one without it
+        """
+        pool = self._sample_pool()
+        if pool is None or count < 2:
+            return [func(i) for i in range(count)]
+        return list(pool.map(func, range(count)))
+
+    def _sample_pool(self):
+        if self.sample_pool is None:
+            threads = self.options['preprocess_threads']
+            # cores are shared by all compute processes of this backend
+            limit = len(self.cpu_layout[self.process_idx % self.slots]['cpus'])
+            if threads > limit:
+                logging.warning("preprocess_threads(%d) is limited to %d by cpu layout", threads, limit)
+                threads = limit
+            if threads < 2:
+                self.sample_pool = False
+            else:
+                self.sample_pool = futures.ThreadPoolExecutor(max_workers=threads)
+        return self.sample_pool or None
+
+    def _stage_buffers(self):
+        """Number of batches a compute process may hold at once, which is the
+        number of input buffers a backend needs not to overwrite a batch in use
+        """
+        if self.options['pipeline']:
+            return 3
+        return 1
+
+    def _prepare_batch(self, task_list, batchsize):
+        """Pipeline stage 1, builds model inputs of a batch
+
+        Backends split `_infer_data` into `_prepare_batch`, `_compute_batch`
+        and `_process_batch` to be pipelined, otherwise the whole inference
+        runs in `_compute_batch`.
+        """
+        return {'task_list': task_list, 'batchsize': batchsize}
+
+    def _compute_batch(self, batch):
+        """Pipeline stage 2, runs the model on a prepared batch
+        """
+        batch['result_lists'] = self._infer_data(batch['task_list'], batch['batchsize'])
+        return batch
+
+    def _process_batch(self, batch):
+        """Pipeline stage 3, returns results of a computed batch
+        """
+        return batch['result_lists']
+
+class ReapedProcess(Process):
+    """Process of the main process, which ignores SIGCHLD (see run.py)
+
+    The kernel reaps such a process as it exits, so `Process.is_alive`, which
+    waits for it, sees it alive forever. Its liveness is told by its sentinel
+    instead, and it is signaled only while alive.
+    """
+    def is_alive(self):
+        if self.pid is None:
+            return False
+        return not wait([self.sentinel], 0)
+
+    def terminate(self):
+        if self.is_alive():
+            super(ReapedProcess, self).terminate()
+
+
+class ForkedProcess():
+    """Compute process forked by a template process, see `_template_loop`
+
+    Handles the process like a `multiprocessing.Process` from the main
+    process, which is not its parent, through its template, which reports
+    its pid and exit, and signals it.
+    """
+    def __init__(self, idx, template, control, pid, exited):
+        self.idx = idx
+        self.template = template
+        self.control = control
+        self.pid_value = pid
+        self.exited = exited
+        self.daemon = True
+
+    def __str__(self):
+        return '<ForkedProcess: iproc-%s, pid %s>' % (self.idx, self.pid)
+    __repr__ = __str__
+
+    @property
+    def pid(self):
+        return self.pid_value.value
+
+    def start(self):
+        self.control.put(('fork', self.idx))
+
+    def is_alive(self):
+        # not forked yet or running, unless its template is gone
+        return not self.exited.value and self.template.is_alive()
+
+    def join(self, timeout=None):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while self.is_alive():
+            if deadline is not None and time.time() >= deadline:
+                return
+            time.sleep(JOIN_POLL)
+
+    def terminate(self):
+        if self.is_alive():
+            self.control.put(('terminate', self.idx))
+
+
 @unique
 class Status(Enum):
     """Backend Status Class
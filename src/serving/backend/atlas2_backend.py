@@ -16,7 +16,6 @@ import cv2
 import numpy as np
 
 from serving.backend.atlas2_acl import *
-from serving.core.memory import IMAGES_POOL
 from serving.backend import abstract_backend as ab
 
 
@@ -95,22 +94,28 @@ class Atlas2Backend(ab.AbstractBackend):
 
     @debug.profiler("Atlas2Backend:_infer_data")
     def _infer_data(self, task_list, batchsize):
+        return self._process_batch(self._compute_batch(self._prepare_batch(task_list, batchsize)))
+
+    def _prepare_batch(self, task_list, batchsize):
         feed_lists, passby_lists = self.__buildBatch(task_list, batchsize)
-        infer_lists = self.__inferBatch(feed_lists, passby_lists)
-        result_lists = self.__processBatch(infer_lists, passby_lists, batchsize)
+        return {'batchsize': batchsize, 'feed_lists': feed_lists, 'passby_lists': passby_lists}
+
+    def _compute_batch(self, batch):
+        batch['infer_lists'] = self.__inferBatch(batch['feed_lists'], batch['passby_lists'])
+        return batch
+
+    def _process_batch(self, batch):
+        result_lists = self.__processBatch(batch['infer_lists'], batch['passby_lists'], batch['batchsize'])
         logging.debug("raw result: %s", result_lists)
         return result_lists
 
     @debug.profiler("Atlas2Backend::__buildBatch")
     def __buildBatch(self, task_list, batchsize):
-        predp_data = [None] * batchsize
+        predp_data = self._preprocess_samples(
+            task_list, batchsize, lambda i, task, frame: {'img': frame, 'extra': task.extra})
         feed_lists = [None] * batchsize
         passby_lists = [None] * batchsize
         for i in range(batchsize):
-            image_frame = IMAGES_POOL[task_list[i].image_id]
-            extra_info = task_list[i].extra
-            del IMAGES_POOL[task_list[i].image_id]
-            predp_data[i] = self.model_predp.pre_dataprocess({'img': image_frame, 'extra': extra_info})
             feed_lists[i] = predp_data[i]['feed_list']
             passby_lists[i] = predp_data[i]['passby']
         return feed_lists, passby_lists
@@ -137,13 +142,10 @@ class Atlas2Backend(ab.AbstractBackend):
         labels = self.model_configs.get('labels')
         threshold = [float(i) for i in self.model_configs.get('threshold')]
         mapping = self.model_configs.get('mapping')
-        result_lists = [None] * batchsize
-        for i in range(batchsize):
-            result_lists[i] = self.model_postdp.post_dataprocess({
-                'infers': infer_lists[i],
-                'labels': labels,
-                'threshold': threshold,
-                'mapping': mapping,
-                'passby': passby_lists[i],
-            })
-        return result_lists
\ No newline at end of file
+        return self._postprocess_samples(batchsize, lambda i: {
+            'infers': infer_lists if i is None else infer_lists[i],
+            'labels': labels,
+            'threshold': threshold,
+            'mapping': mapping,
+            'passby': passby_lists if i is None else passby_lists[i],
+        })
\ No newline at end of file
@@ -22,7 +22,7 @@ for dep in DEPS:
 import tensorflow as tf
 import numpy as np
 
-from serving.core.memory import IMAGES_POOL, FEATURE_GATE
+from serving.core.memory import FEATURE_GATE
 from serving.backend import abstract_backend as ab
 
 
@@ -34,6 +34,9 @@ class TfPyBackend(ab.AbstractBackend):
         super().__init__(configurations)
         self.input_tensor_vec = []
         self.output_tensor_vec = []
+        self.input_type = []
+        self.input_arenas = []
+        self.input_arena = []
 
     @debug.profiler("TfPyBackend::_loadModel")
     def _load_model(self):
@@ -53,12 +56,47 @@ class TfPyBackend(ab.AbstractBackend):
             self.output_tensor_vec = []
             for it in tensor_map['output']:
                 self.output_tensor_vec.append(self.model_object.graph.get_tensor_by_name(it))
+            self.input_type = [int(t) for t in tensor_map['input_type']]
+            self.__initArena()
             return True
         except Exception as err:
             self.output_tensor_vec = []
             self.input_tensor_vec = []
+            self.input_arenas = []
+            self.input_arena = []
             raise err
 
+    def __initArena(self):
+        """Preallocates a contiguous batch buffer for each batched input
+
+        A buffer is shaped as `batchsize` samples of the tensor spec. Inputs
+        whose spec is not fully defined get their buffer from the first batch.
+        There is one arena for each batch which can be in flight at once.
+        """
+        self.input_arenas = []
+        for _ in range(self._stage_buffers()):
+            arena = []
+            for index, t in enumerate(self.input_tensor_vec):
+                shape = t.shape
+                if self.input_type[index] != 1 or shape.ndims is None or not shape[1:].is_fully_defined():
+                    arena.append(None)
+                    continue
+                arena.append(np.empty(
+                    [self.configs['batchsize']] + shape[1:].as_list(), dtype=t.dtype.as_numpy_dtype))
+            self.input_arenas.append(arena)
+        self.input_arena = self.input_arenas[-1]
+
+    def _session_config(self):
+        config = tf.ConfigProto()
+        if FEATURE_GATE['on_tensorflow_gpu_3splits']:
+            config.gpu_options.allow_growth=True
+            config.gpu_options.per_process_gpu_memory_fraction = (1-0.01)/3
+        threads = self._thread_budget()
+        if threads:
+            config.intra_op_parallelism_threads = threads
+            config.inter_op_parallelism_threads = 1
+        return config
+
     @debug.profiler("TfPyBackend::__loadFrozenModel")
     def __loadFrozenModel(self):
         with tf.Graph().as_default():
@@ -67,22 +105,14 @@ class TfPyBackend(ab.AbstractBackend):
             with open(path, "rb") as model_file:
                 graph_def.ParseFromString(model_file.read())
                 tf.import_graph_def(graph_def, name="")
-            config = tf.ConfigProto()
-            if FEATURE_GATE['on_tensorflow_gpu_3splits']:
-                config.gpu_options.allow_growth=True
-                config.gpu_options.per_process_gpu_memory_fraction = (1-0.01)/3
-            self.model_object = tf.Session(config=config)
+            self.model_object = tf.Session(config=self._session_config())
             self.model_object.run(tf.global_variables_initializer())
 
     @debug.profiler("TfPyBackend::__loadUnfrozenModel")
     def __loadUnfrozenModel(self):
         os.rename(os.path.join(self.copy_folder, self.model_filename),
                   os.path.join(self.copy_folder, "saved_model.pb"))
-        config = tf.ConfigProto()
-        if FEATURE_GATE['on_tensorflow_gpu_3splits']:
-            config.gpu_options.allow_growth=True
-            config.gpu_options.per_process_gpu_memory_fraction = (1-0.01)/3
-        self.model_object = tf.Session(graph=tf.Graph(), config=config)
+        self.model_object = tf.Session(graph=tf.Graph(), config=self._session_config())
         tf.saved_model.loader.load(
             self.model_object,
             [tf.saved_model.tag_constants.SERVING],
@@ -94,38 +124,73 @@ class TfPyBackend(ab.AbstractBackend):
     @debug.flow("@abs::ab._infer_data")
     @debug.profiler("TfPyBackend::_infer_data")
     def _infer_data(self, task_list, batchsize):
+        return self._process_batch(self._compute_batch(self._prepare_batch(task_list, batchsize)))
+
+    def _prepare_batch(self, task_list, batchsize):
         if batchsize < 1:
             raise Exception("batchsize smaller than one")
+        # rotate to the arena of the oldest batch, which is finished already
+        self.input_arenas.append(self.input_arenas.pop(0))
+        self.input_arena = self.input_arenas[-1]
         feed_lists, passby_lists = self.__buildBatch(task_list, batchsize)
-        infer_lists = self.__inferBatch(feed_lists)
-        result_lists = self.__processBatch(infer_lists, passby_lists, batchsize)
+        return {'batchsize': batchsize, 'feed_lists': feed_lists, 'passby_lists': passby_lists}
+
+    def _compute_batch(self, batch):
+        batch['infer_lists'] = self.__inferBatch(batch['feed_lists'])
+        return batch
+
+    def _process_batch(self, batch):
+        result_lists = self.__processBatch(batch['infer_lists'], batch['passby_lists'], batch['batchsize'])
         logging.debug("raw result: %s", result_lists)
         return result_lists
 
     @debug.profiler("TfPyBackend::__buildBatch")
     def __buildBatch(self, task_list, batchsize):
-        predp_data = [None] * batchsize
-        #id_lists = [None] * batchsize
-        feed_lists = np.array([[None] * batchsize] * len(self.input_tensor_vec))
+        """Fills input arena in place, one write per sample and input
+
+        `pre_dataprocess` is given the arena slots of its sample as
+        `feed_buffer`, a feed written into its slot directly is not copied.
+        """
         passby_lists = [None] * batchsize
-        input_type = json.loads(self.model_configs['modelext']).get('tensors')['input_type']
+        feed_lists = [None] * len(self.input_tensor_vec)
 
+        predp_data = self._preprocess_samples(
+            task_list, batchsize, lambda i, task, frame: {'img': frame, 'feed_buffer': self.__feedBuffer(i)})
         for i in range(batchsize):
-            image_frame = IMAGES_POOL[task_list[i].image_id]
-            del IMAGES_POOL[task_list[i].image_id]
-            predp_data[i] = self.model_predp.pre_dataprocess({'img': image_frame})
             passby_lists[i] = predp_data[i]['passby']
             for j in range(len(self.input_tensor_vec)):
-                feed_lists[j][i] = np.squeeze(predp_data[i]['feed_list'][j])
-
-        feed_lists_return = []
-        for i in range(len(self.input_tensor_vec)):
-            if int(input_type[i]) == 1:
-                feed_lists_return.append(np.array(feed_lists[i].tolist()))
-            if int(input_type[i]) == 0:
-                feed_lists_return.append(feed_lists[i][0])
-
-        return feed_lists_return, passby_lists
+                feed = predp_data[i]['feed_list'][j]
+                if self.input_type[j] == 0:
+                    if i == 0:
+                        feed_lists[j] = feed
+                    continue
+                slot = self.__arenaSlot(j, i, feed)
+                if not isinstance(feed, np.ndarray) or feed.ctypes.data != slot.ctypes.data:
+                    slot[...] = np.reshape(feed, slot.shape)
+
+        for j in range(len(self.input_tensor_vec)):
+            if self.input_type[j] == 1:
+                feed_lists[j] = self.input_arena[j][:batchsize]
+        return feed_lists, passby_lists
+
+    def _feed_batched(self, index):
+        # inputs of type 0 are fed once for a batch
+        return self.input_type[index] == 1
+
+    def __feedBuffer(self, i):
+        return [None if a is None or i >= len(a) else a[i] for a in self.input_arena]
+
+    def __arenaSlot(self, index, i, feed):
+        arena = self.input_arena[index]
+        if arena is not None and arena.shape[0] > i and arena[i].size == np.size(feed):
+            return arena[i]
+        if i != 0:
+            raise exception.InferenceDataError(msg="inconsistent input shapes in one batch")
+        # (re)allocate by the first sample of a batch, when its spec is not fully defined
+        feed = np.squeeze(feed)
+        arena = np.empty((self.configs['batchsize'],) + feed.shape, dtype=feed.dtype)
+        self.input_arena[index] = arena
+        return arena[0]
 
     @debug.profiler("TfPyBackend::__inferBatch")
     def __inferBatch(self, feed_list):
@@ -140,16 +205,10 @@ class TfPyBackend(ab.AbstractBackend):
         labels = self.model_configs.get('labels')
         threshold = [float(i) for i in self.model_configs.get('threshold')]
         mapping = self.model_configs.get('mapping')
-        result_lists = [None] * batchsize
-
-        for i in range(batchsize):
-            post_frame = {
-                'infers': [infer_lists[k][i] for k in range(len(infer_lists))],
-                'labels': labels,
-                'threshold': threshold,
-                'mapping': mapping,
-                'passby': passby_lists[i]
-            }
-            result_lists[i] = self.model_postdp.post_dataprocess(post_frame)
-
-        return result_lists
+        return self._postprocess_samples(batchsize, lambda i: {
+            'infers': infer_lists if i is None else [infer_lists[k][i] for k in range(len(infer_lists))],
+            'labels': labels,
+            'threshold': threshold,
+            'mapping': mapping,
+            'passby': passby_lists if i is None else passby_lists[i],
+        })
@@ -76,32 +76,25 @@ def stop_backend(configs):
     return b.stop()
 
 @debug.flow("core.reload_model_on_backend")
-@regulator.validate(regulator.backend_bid)
-@regulator.validate(regulator.backend_load)
+@regulator.validate(regulator.backend_reload)
 def reload_model_on_backend(configs):
-    """Load or reload a model on a specific backend
+    """Swap the model of a specific backend, which keeps serving meanwhile
 
     Required field:
-        bid: backend id
-        model:
-            implhash: hash value of labels, head, bone, impl and version
-            OR labels, head, bone, impl and version
-        encrypted: encrypted model, either 1 or 0, otherwise regard as 0
-        a64key: if encrypted model, provide access code
-        pvtkey: if encrypted model, provide decrypt private key path
+        bhash: backend id
+        mhash: model hash
     Optional field:
-        model:
-            modelext: preserved, not use
-    """
-    raise NotImplementedError()
-    """
-    logging.debug("   configs: %s", configs)
-    backend_instance = BACKEND.get(configs['bid'])
-    if backend_instance is None:
-        raise exception.ReloadModelOnBackendError
-    backend_instance.load(configs)
-    return {'code': 0, 'msg': str(configs['bid'])}
+        mcode: if encrypted model, provide access code
+        mpvtk: if encrypted model, provide decrypt private key path
     """
+    b = BACKEND.get(configs['bhash'])
+    if b is None:
+        raise exception.ParamValidationError(": invalid backend id")
+    return b.reload({
+        'mhash': configs['mhash'],
+        'mcode': configs['mcode'],
+        'mpvtk': configs['mpvtk'],
+    })
 
 @debug.flow("core.terminate_backend")
 @regulator.validate(regulator.backend_bid)
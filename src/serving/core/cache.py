@@ -0,0 +1,93 @@
+"""
+  Core.Cache: Result cache
+
+  Contact: arthur.r.song@gmail.com
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultCache():
+    """LRU Result Cache
+
+    Maps keys of requests to their json results, bounded by `max_entries`
+    entries and `max_bytes` bytes of results (0 means unlimited for one of
+    them, both 0 disable the cache). The least recently used entries are
+    evicted first. It lives in the main process only.
+    """
+    def __init__(self, max_entries=0, max_bytes=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return '<ResultCache: %s entries, %s bytes, %s hits, %s misses>' % (
+            len(self.entries), self.used, self.hits, self.misses)
+    __repr__ = __str__
+
+    @staticmethod
+    def key(payload, *parts):
+        """Returns a key of `payload` bytes, along with any given `parts`
+        """
+        digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        return ':'.join([str(p) for p in parts] + [digest])
+
+    def set_budget(self, max_entries, max_bytes):
+        with self.lock:
+            self.max_entries = max(0, int(max_entries or 0))
+            self.max_bytes = max(0, int(max_bytes or 0))
+            self._evict()
+
+    def enabled(self):
+        return self.max_entries > 0 or self.max_bytes > 0
+
+    def get(self, key):
+        """Returns the result of `key` or None, and counts a hit or miss
+        """
+        if not self.enabled():
+            return None
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        if not self.enabled():
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self.entries[key] = result
+            self.used += len(result)
+            self._evict()
+
+    def usage(self):
+        return {
+            'entries': len(self.entries),
+            'used': self.used,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while self.entries and (
+                (self.max_entries and len(self.entries) > self.max_entries) or
+                (self.max_bytes and self.used > self.max_bytes)):
+            _, result = self.entries.popitem(last=False)
+            self.used -= len(result)
+            self.evictions += 1
@@ -4,14 +4,31 @@
   Contact: arthur.r.song@gmail.com
 """
 
+import json
+import time
 import uuid
+import queue
 import logging
+import threading
+from concurrent import futures
+from enum import Enum, unique
+
+import numpy as np
 
 from serving.core import debug
 from serving.core import scheduler
 from serving.core import regulator
-from serving.core.memory import FEATURE_GATE, BACKEND, IMAGES_POOL, PLUGIN
-from serving.core.exception import InferenceDataError
+from serving.core.memory import FEATURE_GATE, BACKEND, IMAGES_POOL, PLUGIN, RESULT_CACHE
+from serving.core.exception import InferenceDataError, InferTimeOutError, TenantRateLimitError, TruenoException
+
+
+@unique
+class DataType(Enum):
+    """Data type of `InferRequest.data`, given by `InferRequest.dtype`
+    """
+    Encoded = 0     # encoded image (e.g. jpeg), decoded by reader plugin
+    RawUint8 = 1    # raw uint8 HWC frame, `extra` gives {"shape": [h, w, c]}
+    RawFloat32 = 2  # raw float32 tensor, `extra` gives {"shape": [...]}
 
 
 @debug.flow("compute.local_async")
@@ -22,10 +39,14 @@ def local_async(data):
     backend_instance = BACKEND.get(data.get('bid'))
     if backend_instance is None:
         raise RuntimeError("failed to find backend")
+    _admit_tenant(backend_instance, data)
     img_uuid = str(uuid.uuid4())
-    IMAGES_POOL[img_uuid] = PLUGIN['reader'].read_image({'source': data['path']})
-    backend_instance.enqueue_task(
-        scheduler.Task(task_id=data['uuid'], image_id=img_uuid))
+    frame = PLUGIN['reader'].read_image({'source': data['path']})
+    IMAGES_POOL[img_uuid] = frame
+    task = scheduler.Task(task_id=data['uuid'], image_id=img_uuid)
+    task.nbytes = frame.nbytes
+    _schedule_task(task, data)
+    backend_instance.enqueue_task(task)
 
 @debug.flow("compute.remote_async")
 @regulator.validate(regulator.compute_required)
@@ -35,22 +56,378 @@ def remote_async(data):
     backend_instance = BACKEND.get(data.get('bid'))
     if backend_instance is None:
         raise InferenceDataError(msg="failed to find backend")
-    img_uuid = str(uuid.uuid4())
     #IMAGES_POOL[img_uuid] = PLUGIN['exbase64'].mem_b64_to_cvmat(
     #    bytes(data['base64'], encoding='utf8'),
     #    list(data['shape'])
     #)
-    IMAGES_POOL[img_uuid] = PLUGIN['reader'].read_buffer({'source': data['data']})
-    backend_instance.enqueue_task(
-        scheduler.Task(task_id=data['uuid'], image_id=img_uuid))
+    task = _buffer_task(backend_instance, data, dtype=data['dtype'])
+    if task.cached is not None:
+        backend_instance.post_result(task, task.cached)
+        return
+    backend_instance.enqueue_task(task)
+
+@debug.flow("compute.remote_sync")
+@regulator.validate(regulator.compute_sync)
+@regulator.validate(regulator.compute_remote)
+@regulator.if_feature_on_run(FEATURE_GATE['on_statistic'], PLUGIN['statistic'])
+def remote_sync(data):
+    """Inferences remotely and waits for the result
+
+    Waits `data['timeout']` seconds, by default `sync_timeout_ms` of the
+    backend. Returns the result as json string.
+    """
+    backend_instance = BACKEND.get(data.get('bid'))
+    if backend_instance is None:
+        raise InferenceDataError(msg="failed to find backend")
+    task = _buffer_task(backend_instance, data, dtype=data['dtype'])
+    return _wait_task(backend_instance, task, data.get('timeout'))
+
+@debug.flow("compute.remote_stream")
+def remote_stream(data_iter, is_active):
+    """Inferences a stream of requests, yields `(uuid, result, error)` as
+    soon as each result is ready
+
+    A feeder thread reads the next request only when the stream has less than
+    `stream_window` tasks in flight and the backend queue has room, so a slow
+    backend pushes back on the client through gRPC flow control. Stops when
+    `is_active` returns False.
+    """
+    done = queue.Queue()
+    slots = []
+    feeder = threading.Thread(target=_feed_stream, args=(data_iter, is_active, done, slots), daemon=True)
+    feeder.start()
+    count, total = 0, None
+    while total is None or count < total:
+        try:
+            item = done.get(timeout=0.5)
+        except queue.Empty:
+            if not is_active():
+                return
+            continue
+        if item[0] is None:
+            total = item[1]
+            continue
+        count += 1
+        slots[0].release()
+        yield item
+
+def _feed_stream(data_iter, is_active, done, slots):
+    total = 0
+    try:
+        for data in data_iter:
+            backend_instance = BACKEND.get(data.get('bid'))
+            if not slots:
+                window = 1 if backend_instance is None else backend_instance.stream_window()
+                slots.append(threading.Semaphore(window))
+            while not slots[0].acquire(timeout=0.5):
+                if not is_active():
+                    return
+            total += 1
+            try:
+                future = _submit_stream(backend_instance, data, is_active)
+            except TruenoException as err:
+                done.put((data.get('uuid'), None, err))
+                continue
+            except Exception:
+                # closes the stream, not counted as no item is yielded for it
+                total -= 1
+                slots[0].release()
+                raise
+            future.add_done_callback(lambda f, u=data['uuid']: done.put(_stream_result(u, f)))
+    except Exception as err:
+        logging.warning("stream is closed by: %s", repr(err))
+    finally:
+        done.put((None, total, None))
+
+def _submit_stream(backend_instance, data, is_active):
+    regulator.compute_sync(data)
+    regulator.compute_remote(data)
+    if FEATURE_GATE['on_statistic']:
+        PLUGIN['statistic']()
+    if backend_instance is None:
+        raise InferenceDataError(msg="failed to find backend")
+    while not backend_instance.wait_for_room(0.5):
+        if not is_active():
+            raise InferTimeOutError()
+    return _submit_task(backend_instance, _buffer_task(backend_instance, data, dtype=data['dtype']))
+
+def _stream_result(task_id, future):
+    try:
+        return (task_id, future.result(), None)
+    except TruenoException as err:
+        return (task_id, None, err)
+
+@debug.flow("compute.remote_batch")
+@regulator.if_feature_on_run(FEATURE_GATE['on_statistic'], PLUGIN['statistic'])
+def remote_batch(data):
+    """Inferences `data['items']` on backend `data['bid']` and waits for all
+    results
+
+    Valid items are enqueued atomically, so they share batches of the backend.
+    Returns a list of `(uuid, result, error)` in the order of items, an item
+    which fails to be buffered or computed carries its error instead.
+    """
+    backend_instance = BACKEND.get(data.get('bid'))
+    if backend_instance is None:
+        raise InferenceDataError(msg="failed to find backend")
+    timeout = data.get('timeout')
+    if timeout is None:
+        timeout = backend_instance.options['sync_timeout_ms'] / 1000.0
+    deadline = time.time() + timeout
+    reply_list = [None] * len(data['items'])
+    task_list, index_list = [], []
+    for idx, item in enumerate(data['items']):
+        try:
+            regulator.compute_sync(item)
+            regulator.compute_remote(item)
+            task_list.append(_buffer_task(backend_instance, item, dtype=item['dtype']))
+            _limit_deadline(task_list[-1], timeout)
+            index_list.append(idx)
+        except TruenoException as err:
+            reply_list[idx] = (item.get('uuid'), None, err)
+    future_list = _submit_tasks(backend_instance, task_list)
+    for task, idx, future in zip(task_list, index_list, future_list):
+        try:
+            reply_list[idx] = (task.task_id, future.result(timeout=max(deadline - time.time(), 0)), None)
+        except futures.TimeoutError:
+            backend_instance.forget_task(task)
+            reply_list[idx] = (task.task_id, None, InferTimeOutError())
+        except TruenoException as err:
+            reply_list[idx] = (task.task_id, None, err)
+    return reply_list
+
+@debug.flow("compute.fanout_sync")
+@regulator.validate(regulator.compute_sync)
+@regulator.validate(regulator.compute_fanout)
+@regulator.if_feature_on_run(FEATURE_GATE['on_statistic'], PLUGIN['statistic'])
+def fanout_sync(data):
+    """Inferences one image on every backend of `data['bids']` in parallel
+
+    The image is decoded once and published once into IMAGES_POOL, shared by
+    all backends which do not decode inside compute processes. Waits for the
+    slowest backend, up to `data['timeout']` or the largest `sync_timeout_ms`.
+    Results go to outlets of the backends as well, if `data['outlets']` is set.
+    Returns a list of `(bid, result, error)` in the order of `data['bids']`.
+    """
+    backend_list = []
+    for bid in data['bids']:
+        backend_instance = BACKEND.get(bid)
+        if backend_instance is None:
+            raise InferenceDataError(msg="failed to find backend: {}".format(bid))
+        _admit_tenant(backend_instance, data)
+        backend_list.append((bid, backend_instance))
+    try:
+        dtype = DataType(data['dtype'])
+    except ValueError:
+        raise InferenceDataError(msg="unsupported dtype: {}".format(data['dtype']))
+    extra_info = data.get('extra', '')
+    cached = {}
+    for _, b in backend_list:
+        cache_key = _cache_key(b, data, extra_info, dtype)
+        cached[b] = (cache_key, cache_key and RESULT_CACHE.get(cache_key))
+    shared = [b for _, b in backend_list if cached[b][1] is None and
+              (dtype != DataType.Encoded or not b.options['decode_in_compute'])]
+    img_uuid, nbytes = None, 0
+    if shared:
+        frame = _read_frame(data, dtype)
+        img_uuid, nbytes = str(uuid.uuid4()), frame.nbytes
+        IMAGES_POOL.put(img_uuid, frame, refs=len(shared))
+
+    timeout = data.get('timeout')
+    if timeout is None:
+        timeout = max([b.options['sync_timeout_ms'] for _, b in backend_list]) / 1000.0
+    deadline = time.time() + timeout
+    pending, reply_list = [], []
+    for bid, backend_instance in backend_list:
+        if cached[backend_instance][1] is not None:
+            task = scheduler.Task(task_id=data['uuid'], image_id=None, extra=extra_info)
+        elif backend_instance in shared:
+            task = scheduler.Task(task_id=data['uuid'], image_id=img_uuid, extra=extra_info)
+            task.nbytes = nbytes
+        else:
+            task = scheduler.Task(task_id=data['uuid'], image_id=None, extra=extra_info, payload=data['data'])
+            task.nbytes = len(data['data'])
+        task.cache_key, task.cached = cached[backend_instance]
+        task.post_outlets = bool(data.get('outlets'))
+        if task.cached is not None and task.post_outlets:
+            backend_instance.post_result(task, task.cached)
+        _schedule_task(task, data)
+        _limit_deadline(task, timeout)
+        try:
+            pending.append((task, _submit_task(backend_instance, task)))
+        except TruenoException as err:
+            pending.append((task, err))
+    for (bid, backend_instance), (task, future) in zip(backend_list, pending):
+        if isinstance(future, TruenoException):
+            reply_list.append((bid, None, future))
+            continue
+        try:
+            reply_list.append((bid, future.result(timeout=max(deadline - time.time(), 0)), None))
+        except futures.TimeoutError:
+            backend_instance.forget_task(task)
+            reply_list.append((bid, None, InferTimeOutError()))
+        except TruenoException as err:
+            reply_list.append((bid, None, err))
+    return reply_list
+
+def _wait_task(backend_instance, task, timeout=None):
+    if timeout is None:
+        timeout = backend_instance.options['sync_timeout_ms'] / 1000.0
+    _limit_deadline(task, timeout)
+    future = _submit_task(backend_instance, task)
+    try:
+        return future.result(timeout=timeout)
+    except futures.TimeoutError:
+        backend_instance.forget_task(task)
+        raise InferTimeOutError()
 
 @debug.flow("compute.restful_sync")
+@regulator.validate(regulator.compute_sync)
 def restful_sync(data):
+    """Inferences an encoded image for RESTful request and waits for the result
+
+    Each request owns a unique id, so concurrent requests share batches of the
+    backend and never wait for each other. The result goes to outlets of the
+    backend as well. Returns the result as json string.
+    """
     backend_instance = BACKEND.get(data.get('bid'))
     extra_info = data.get('extra', '')
     if backend_instance is None:
         raise InferenceDataError(msg="failed to find backend")
+    task = _buffer_task(backend_instance, data, extra=extra_info)
+    task.post_outlets = True
+    if task.cached is not None:
+        backend_instance.post_result(task, task.cached)
+    return _wait_task(backend_instance, task)
+
+def _buffer_task(backend_instance, data, extra='', dtype=DataType.Encoded.value):
+    """Creates a task from an image buffer of the given `dtype`
+
+    Encoded buffer is decoded here into IMAGES_POOL, unless the backend decodes
+    inside its compute processes, then the compressed bytes travel with the
+    task. Raw buffer is wrapped without copying, then copied once into
+    IMAGES_POOL.
+    """
+    try:
+        dtype = DataType(dtype)
+    except ValueError:
+        raise InferenceDataError(msg="unsupported dtype: {}".format(dtype))
+    _admit_tenant(backend_instance, data)
+    cache_key = _cache_key(backend_instance, data, extra, dtype)
+    if cache_key is not None:
+        result = RESULT_CACHE.get(cache_key)
+        if result is not None:
+            task = scheduler.Task(task_id=data['uuid'], image_id=None, extra=extra)
+            task.cached = result
+            return task
+    # a request joining one in flight is never decoded, but it still carries
+    # its data in case the other one lands before it is enqueued
+    if dtype == DataType.Encoded and (backend_instance.options['decode_in_compute'] or
+                                      backend_instance.in_flight(cache_key)):
+        task = scheduler.Task(task_id=data['uuid'], image_id=None, extra=extra, payload=data['data'])
+        task.nbytes = len(data['data'])
+        task.cache_key = cache_key
+        _schedule_task(task, data)
+        return task
+    frame = _read_frame(data, dtype)
     img_uuid = str(uuid.uuid4())
-    IMAGES_POOL[img_uuid] = PLUGIN['reader'].read_buffer({'source': data['data']})
-    backend_instance.enqueue_task(
-        scheduler.Task(task_id=data['uuid'], image_id=img_uuid, extra=extra_info))
+    IMAGES_POOL[img_uuid] = frame
+    task = scheduler.Task(task_id=data['uuid'], image_id=img_uuid, extra=extra)
+    task.nbytes = frame.nbytes
+    task.cache_key = cache_key
+    _schedule_task(task, data)
+    return task
+
+def _cache_key(backend_instance, data, extra, dtype):
+    """Key of a request in RESULT_CACHE and in-flight requests of the backend,
+    None when neither the cache nor `coalesce` option is enabled
+
+    Byte-identical data of the same dtype and extra, inferenced by the same
+    model with the same threshold and mapping (disthash), share one result.
+    """
+    if not RESULT_CACHE.enabled() and not backend_instance.options['coalesce']:
+        return None
+    # extra of the task, and extra of the request (e.g. shape of raw data)
+    suffix = json.dumps([extra or '', data.get('extra') or ''], sort_keys=True)
+    return RESULT_CACHE.key(
+        bytes(data['data']) + b'\x00' + suffix.encode(),
+        backend_instance.configs['mhash'],
+        backend_instance.model_configs.get('disthash', ''),
+        DataType(dtype).value,
+    )
+
+def _submit_task(backend_instance, task):
+    # a cached result resolves its future right away
+    if task.cached is None:
+        return backend_instance.submit_task(task)
+    future = futures.Future()
+    future.set_result(task.cached)
+    return future
+
+def _submit_tasks(backend_instance, task_list):
+    future_list = [None] * len(task_list)
+    pending = [idx for idx, task in enumerate(task_list) if task.cached is None]
+    if pending:
+        submitted = backend_instance.submit_tasks([task_list[idx] for idx in pending])
+        for idx, future in zip(pending, submitted):
+            future_list[idx] = future
+    for idx, task in enumerate(task_list):
+        if task.cached is not None:
+            future_list[idx] = _submit_task(backend_instance, task)
+    return future_list
+
+def _tenant_of(data):
+    """Tenant of a request, given by `data['tenant']` or the prefix of its uuid
+    before `:`, e.g. `ops:0b5d...`
+    """
+    if data.get('tenant'):
+        return data['tenant']
+    task_id = data.get('uuid') or ''
+    if ':' in task_id:
+        return task_id.split(':', 1)[0]
+    return ''
+
+def _admit_tenant(backend_instance, data):
+    if not backend_instance.take_token(_tenant_of(data)):
+        raise TenantRateLimitError()
+
+def _schedule_task(task, data):
+    """Sets tenant, priority and deadline of `task` from `data['priority']`
+    and `data['deadline_ms']` (relative to its arrival, 0 means no deadline)
+    """
+    task.tenant = _tenant_of(data)
+    try:
+        task.priority = int(data.get('priority') or 0)
+        deadline_ms = int(data.get('deadline_ms') or 0)
+    except (TypeError, ValueError):
+        raise InferenceDataError(msg="invalid priority or deadline_ms")
+    if deadline_ms > 0:
+        task.deadline = task.timestamp + deadline_ms / 1000.0
+
+def _limit_deadline(task, timeout):
+    # a caller waiting for `timeout` seconds needs no result after that
+    deadline = task.timestamp + timeout
+    if task.deadline is None or deadline < task.deadline:
+        task.deadline = deadline
+
+def _read_frame(data, dtype):
+    if dtype != DataType.Encoded:
+        return _wrap_raw_buffer(data, dtype)
+    frame = PLUGIN['reader'].read_buffer({'source': data['data']})
+    if frame is None:
+        raise InferenceDataError(msg="image is damaged")
+    return frame
+
+def _wrap_raw_buffer(data, dtype):
+    try:
+        shape = tuple(json.loads(data['extra'])['shape'])
+    except (ValueError, TypeError, KeyError):
+        raise InferenceDataError(msg="raw data requires shape in extra, e.g. {\"shape\": [h, w, c]}")
+    np_dtype = np.uint8
+    if dtype == DataType.RawFloat32:
+        np_dtype = np.float32
+    elif len(shape) not in [2, 3]:
+        raise InferenceDataError(msg="raw uint8 data requires HW or HWC shape")
+    if int(np.prod(shape)) * np.dtype(np_dtype).itemsize != len(data['data']):
+        raise InferenceDataError(msg="raw data does not match shape: {}".format(shape))
+    return np.frombuffer(data['data'], dtype=np_dtype).reshape(shape)
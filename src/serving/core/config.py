@@ -142,6 +142,15 @@ def lim_max_backend_count():
 def lim_max_compute_process():
     return SYS_CONFIGS['lmt']['max_compute_process']
 
+def lim_max_frame_store_bytes():
+    return SYS_CONFIGS['lmt'].get('max_frame_store_bytes', 0)
+
+def lim_max_result_cache_entries():
+    return SYS_CONFIGS['lmt'].get('max_result_cache_entries', 0)
+
+def lim_max_result_cache_bytes():
+    return SYS_CONFIGS['lmt'].get('max_result_cache_bytes', 0)
+
 #
 def _get_str(key, default_val):
     return str(_get_val(key, default_val))
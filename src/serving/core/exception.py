@@ -98,6 +98,43 @@ class InferTimeOutError(TruenoException):
             msg = "inference timeout",
         )
 
+class FrameStoreExhaustedError(TruenoException):
+    def __init__(self):
+        super(FrameStoreExhaustedError, self).__init__(
+            code=115,
+            msg="frame store exceeds its byte budget",
+        )
+
+class BackendOverloadError(TruenoException):
+    def __init__(self):
+        super(BackendOverloadError, self).__init__(
+            code=116,
+            msg="backend task queue is full",
+        )
+
+class TenantRateLimitError(BackendOverloadError):
+    def __init__(self):
+        # handled as an overload, with its own code
+        super(BackendOverloadError, self).__init__(
+            code=117,
+            msg="tenant exceeds its rate limit",
+        )
+
+class BackendDrainingError(BackendOverloadError):
+    def __init__(self):
+        # handled as an overload, with its own code
+        super(BackendOverloadError, self).__init__(
+            code=118,
+            msg="backend is stopping and admits no more tasks",
+        )
+
+class ComputeProcessError(TruenoException):
+    def __init__(self):
+        super(ComputeProcessError, self).__init__(
+            code=119,
+            msg="compute process failed on this task",
+        )
+
 class BackendDependencyError(TruenoException):
     def __init__(self):
         super(BackendDependencyError, self).__init__(
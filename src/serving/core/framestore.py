@@ -0,0 +1,200 @@
+"""
+  Core.FrameStore: Shared-memory frame store
+
+  Contact: arthur.r.song@gmail.com
+"""
+
+import os
+import mmap
+import struct
+import logging
+from multiprocessing import Lock, Manager, Value
+
+import numpy as np
+
+from serving.core import exception
+
+SHM_ROOT = '/dev/shm'
+# header: dtype string, ndim, shape (up to 8 dims), and reference count at the end
+HEADER_FORMAT = '8sI8Q'
+HEADER_SIZE = 128
+REFS_FORMAT = 'Q'
+REFS_OFFSET = HEADER_SIZE - 8
+MAX_NDIM = 8
+
+
+class FrameStore():
+    """Shared-memory Frame Store
+
+    Each frame is copied once into its own POSIX shared-memory segment, which
+    is named after the frame key and starts with a header describing its dtype
+    and shape. Any process forked from the main process maps a segment by key
+    only and gets a zero-copy `numpy` view on it. Views are mapped
+    copy-on-write, so a consumer which modifies its frame in place never
+    touches the shared one. A frame is unlinked when it is deleted (consumed),
+    the mapping itself goes away with the last view, and the total size of all
+    living frames is bounded by `budget` bytes (0 means unlimited).
+
+    A frame published to several consumers (e.g. backends of a fan-out) is
+    stored once with `put(key, frame, refs)`, each delete drops one reference
+    and the last one unlinks the frame.
+
+    When `/dev/shm` is not available, it falls back to a `Manager().dict()`
+    which pickles frames through the manager proxy.
+    """
+    def __init__(self, budget=0):
+        self.prefix = 'ligo{}_'.format(os.getpid())
+        self.budget = Value('Q', budget, lock=False)
+        self.used = Value('Q', 0, lock=False)
+        self.count = Value('Q', 0, lock=False)
+        self.lock = Lock()
+        self.fallback = None
+        self.fallback_refs = None
+        if not os.path.isdir(SHM_ROOT):
+            logging.warning("%s is not available, frames go through Manager().dict()", SHM_ROOT)
+            manager = Manager()
+            self.fallback = manager.dict()
+            self.fallback_refs = manager.dict()
+
+    def __str__(self):
+        return '<FrameStore: %s frames, %s/%s bytes>' % (
+            self.count.value, self.used.value, self.budget.value)
+    __repr__ = __str__
+
+    def set_budget(self, budget):
+        if not isinstance(budget, int) or budget < 0:
+            budget = 0
+        self.budget.value = budget
+
+    def usage(self):
+        return {
+            'frames': self.count.value,
+            'used': self.used.value,
+            'budget': self.budget.value,
+        }
+
+    def __setitem__(self, key, frame):
+        self.put(key, frame)
+
+    def put(self, key, frame, refs=1):
+        """Stores `frame` under `key`, which is freed after `refs` deletes
+        """
+        if self.fallback is not None:
+            with self.lock:
+                self.fallback[key] = frame
+                self.fallback_refs[key] = refs
+            return
+        if not isinstance(frame, np.ndarray):
+            raise exception.InferenceDataError(msg="frame is not a valid image: {}".format(type(frame)))
+        if frame.ndim > MAX_NDIM:
+            raise exception.InferenceDataError(msg="frame has too many dimensions")
+        size = HEADER_SIZE + frame.nbytes
+        with self.lock:
+            if self.budget.value != 0 and self.used.value + size > self.budget.value:
+                raise exception.FrameStoreExhaustedError()
+            self.used.value += size
+            self.count.value += 1
+        try:
+            fd = os.open(self._path(key), os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+            try:
+                os.ftruncate(fd, size)
+                buf = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except Exception:
+            self._release(size)
+            raise
+        shape = list(frame.shape) + [0] * (MAX_NDIM - frame.ndim)
+        struct.pack_into(HEADER_FORMAT, buf, 0, frame.dtype.str.encode(), frame.ndim, *shape)
+        struct.pack_into(REFS_FORMAT, buf, REFS_OFFSET, refs)
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=buf, offset=HEADER_SIZE)
+        view[...] = frame
+        del view
+        buf.close()
+
+    def __getitem__(self, key):
+        if self.fallback is not None:
+            return self.fallback[key]
+        try:
+            fd = os.open(self._path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            raise KeyError(key)
+        try:
+            buf = mmap.mmap(fd, os.fstat(fd).st_size, access=mmap.ACCESS_COPY)
+        finally:
+            os.close(fd)
+        header = struct.unpack_from(HEADER_FORMAT, buf, 0)
+        dtype = np.dtype(header[0].rstrip(b'\x00').decode())
+        # the view owns the mapping, it is unmapped once the view is collected
+        return np.ndarray(header[2:2+header[1]], dtype=dtype, buffer=buf, offset=HEADER_SIZE)
+
+    def __delitem__(self, key):
+        """Drops one reference of the frame, unlinks it with the last one
+        """
+        if self.fallback is not None:
+            with self.lock:
+                refs = self.fallback_refs.pop(key, 1) - 1
+                if refs > 0:
+                    self.fallback_refs[key] = refs
+                    return
+                del self.fallback[key]
+            return
+        path = self._path(key)
+        with self.lock:
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                raise KeyError(key)
+            try:
+                refs = struct.unpack(REFS_FORMAT, os.pread(fd, 8, REFS_OFFSET))[0]
+                if refs > 1:
+                    os.pwrite(fd, struct.pack(REFS_FORMAT, refs - 1), REFS_OFFSET)
+                    return
+                size = os.fstat(fd).st_size
+                os.unlink(path)
+            finally:
+                os.close(fd)
+        self._release(size)
+
+    def __contains__(self, key):
+        if self.fallback is not None:
+            return key in self.fallback
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        if self.fallback is not None:
+            return len(self.fallback)
+        return self.count.value
+
+    def pop(self, key):
+        """Returns the frame of `key` and drops one reference of it
+
+        The returned view stays valid until it is garbage collected.
+        """
+        frame = self[key]
+        del self[key]
+        return frame
+
+    def clear(self):
+        """Unlinks all frames created by this store, used on exit
+        """
+        if self.fallback is not None:
+            self.fallback.clear()
+            self.fallback_refs.clear()
+            return
+        for name in os.listdir(SHM_ROOT):
+            if name.startswith(self.prefix):
+                try:
+                    size = os.stat(os.path.join(SHM_ROOT, name)).st_size
+                    os.unlink(os.path.join(SHM_ROOT, name))
+                except FileNotFoundError:
+                    continue
+                self._release(size)
+
+    def _path(self, key):
+        return os.path.join(SHM_ROOT, self.prefix + str(key))
+
+    def _release(self, size):
+        with self.lock:
+            self.used.value -= min(size, self.used.value)
+            self.count.value -= min(1, self.count.value)
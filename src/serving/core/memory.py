@@ -4,7 +4,8 @@
   Contact: arthur.r.song@gmail.com
 """
 
-from multiprocessing import Manager
+from serving.core import cache
+from serving.core import framestore
 
 SYS_CONFIGS = {}
 
@@ -13,7 +14,9 @@ BACKEND = {}
 WORK = {}
 # TODO(arth): registrer IMAGES_POOL to network
 # https://www.jianshu.com/p/f93a055b1723
-IMAGES_POOL = Manager().dict()
+IMAGES_POOL = framestore.FrameStore()
+# results of byte-identical requests, disabled until its budget is set
+RESULT_CACHE = cache.ResultCache()
 
 FEATURE_GATE = {
     'on_multiple_mode': True,
@@ -5,6 +5,7 @@
 """
 
 import json
+import uuid
 import logging
 
 from serving.core import config
@@ -71,10 +72,136 @@ def backend_initialize(args):
         args['inferprocnum'] = 1
     #ConstrainBackendInfo(args)
 
+def backend_options(args):
+    """Validates backend options, which come from the JSON `configs` of a backend
+
+    Optional field:
+        max_batch_delay_ms: once the oldest task of a partial batch has waited
+            this long, dispatch the batch as it is, by default waits for a full batch
+        decode_in_compute: send compressed images along with tasks, and decode
+            them inside compute processes, by default decodes in request handlers
+        max_queue_depth: max number of queued tasks, by default 0 (unlimited)
+        max_queue_bytes: max bytes of queued images, by default 0 (unlimited)
+        shed_policy: what to do with a full queue, either `reject` the newest
+            task (default), `drop_oldest` queued task, or `block` with timeout
+        block_timeout_ms: how long `block` policy waits, by default 1000
+        sync_timeout_ms: how long a synchronous inference waits for its result
+            when its caller gives no deadline, by default 60000
+        stream_window: how many tasks a stream keeps in flight, by default 0
+            which means twice of `batchsize`
+        pipeline: overlaps preparing, computing and processing of consecutive
+            batches inside each compute process by three threads
+        dispatcher: forms batches centrally and sends each to the compute
+            process with the fewest batches in flight, by default compute
+            processes take tasks from the shared queue by themselves
+        tenant_weights: weights of tenants for weighted fair queuing of batches,
+            e.g. {"ops": 4, "*": 1}, by default all tenants share one FIFO;
+            without `dispatcher`, each compute process only weighs the tasks
+            within its batching window
+        tenant_rates: token-bucket limits of tenants in requests per second,
+            e.g. {"bulk": 50}, `*` for the others, by default unlimited
+        preprocess_threads: number of threads preprocessing samples of a batch
+            in each compute process, limited to cpu count / `cpcount`, by
+            default 0 (one by one)
+        drain_timeout_ms: how long stopping a backend waits for its accepted
+            tasks to finish before terminating compute processes, by default 30000,
+            also for processes of the previous model on reload
+        swap_timeout_ms: how long reloading a running backend waits for the
+            processes of the new model to load and preheat, by default 300000
+        autoscale: adds or retires compute processes by queue depth, queue
+            wait and utilization of processes, starting with `cpcount`
+        min_cpcount: fewest compute processes of autoscaling, by default 1
+        max_cpcount: most compute processes of autoscaling, by default and at
+            most `lmt.max_compute_process`
+        scale_up_wait_ms: queue wait which adds a process, by default 200
+        scale_down_busy: utilization (0 to 1) of processes below which one is
+            retired while the queue is empty, by default 0.3
+        scale_cooldown_ms: least time between two scalings, by default 30000
+        cpu_set: ids of CPUs shared by compute processes, by default all CPUs
+            available to the server
+        cpu_affinity: pins each compute process to its own share of `cpu_set`
+        thread_budget: limits intra-op threads of the model, OpenCV and OpenMP
+            threads of each compute process to the size of its share, and
+            inter-op threads to 1, by default libraries use every core
+        watchdog: respawns crashed or hung compute processes and re-queues
+            their tasks, by default true
+        hang_timeout_ms: how long a compute process may hold tasks without
+            finishing any before it counts as hung, by default 60000
+        max_task_retries: how many times a task is re-queued after its compute
+            process failed, before it fails, by default 1
+        prefork: loads the model once in a template process, which forks
+            compute processes sharing it copy-on-write, only for backends whose
+            runtime is safe to fork (e.g. generic), by default false
+        coalesce: attaches requests with byte-identical data to the same
+            request in flight, which is inferenced once for all of them
+    """
+    logging.debug("   raw options: %s", args)
+    delay = args.get('max_batch_delay_ms')
+    if delay is not None and (not isinstance(delay, (int, float)) or delay < 0):
+        raise exception.ParamValidationError(": max_batch_delay_ms")
+    args['max_batch_delay_ms'] = delay
+    args['decode_in_compute'] = bool(args.get('decode_in_compute', False))
+    args['pipeline'] = bool(args.get('pipeline', False))
+    args['dispatcher'] = bool(args.get('dispatcher', False))
+    args['coalesce'] = bool(args.get('coalesce', False))
+    args['autoscale'] = bool(args.get('autoscale', False))
+    args['watchdog'] = bool(args.get('watchdog', True))
+    args['prefork'] = bool(args.get('prefork', False))
+    args['cpu_affinity'] = bool(args.get('cpu_affinity', False))
+    args['thread_budget'] = bool(args.get('thread_budget', False))
+    if args.get('cpu_set') is None:
+        args['cpu_set'] = []
+    if not isinstance(args['cpu_set'], list) or \
+        not all([isinstance(c, int) and c >= 0 for c in args['cpu_set']]):
+        raise exception.ParamValidationError(": cpu_set")
+    for key, default in [('max_queue_depth', 0), ('max_queue_bytes', 0), ('block_timeout_ms', 1000),
+                         ('sync_timeout_ms', 60000), ('stream_window', 0), ('preprocess_threads', 0),
+                         ('drain_timeout_ms', 30000), ('min_cpcount', 1), ('max_cpcount', 0),
+                         ('scale_up_wait_ms', 200), ('scale_cooldown_ms', 30000),
+                         ('hang_timeout_ms', 60000), ('max_task_retries', 1),
+                         ('swap_timeout_ms', 300000)]:
+        if args.get(key) is None:
+            args[key] = default
+        if not isinstance(args[key], int) or args[key] < 0:
+            raise exception.ParamValidationError(": {}".format(key))
+    for key in ['tenant_weights', 'tenant_rates']:
+        if args.get(key) is None:
+            args[key] = {}
+        if not isinstance(args[key], dict):
+            raise exception.ParamValidationError(": {}".format(key))
+        for val in args[key].values():
+            if not isinstance(val, (int, float)) or val <= 0:
+                raise exception.ParamValidationError(": {}".format(key))
+    limitation = config.lim_max_compute_process()
+    if not isinstance(limitation, int) or limitation < 2:
+        limitation = 2
+    if args['max_cpcount'] == 0 or args['max_cpcount'] > limitation:
+        args['max_cpcount'] = limitation
+    if args['min_cpcount'] < 1 or args['min_cpcount'] > args['max_cpcount']:
+        raise exception.ParamValidationError(": min_cpcount")
+    if args.get('scale_down_busy') is None:
+        args['scale_down_busy'] = 0.3
+    if not isinstance(args['scale_down_busy'], (int, float)) or not 0 <= args['scale_down_busy'] <= 1:
+        raise exception.ParamValidationError(": scale_down_busy")
+    if args.get('shed_policy') is None:
+        args['shed_policy'] = 'reject'
+    if args['shed_policy'] not in ['reject', 'drop_oldest', 'block']:
+        raise exception.ParamValidationError(": shed_policy")
+
 def backend_bid(args):
     if args.get('bid') is None:
         raise exception.ParamValidationError(": backend id")
 
+def backend_reload(args):
+    if args.get('bhash') is None:
+        raise exception.ParamValidationError(": backend id")
+    if not args.get('mhash'):
+        raise exception.ParamValidationError(": model hash")
+    if args.get('mcode') is None:
+        args['mcode'] = ""
+    if args.get('mpvtk') is None:
+        args['mpvtk'] = ""
+
 def backend_load(args):
     logging.debug("   raw args: %s", args)
     if args.get('model') is None:
@@ -110,6 +237,15 @@ def compute_required(args):
     if args.get('outlet') is None:
         raise exception.ParamValidationError(": outlet id")
 
+def compute_sync(args):
+    if not args.get('uuid'):
+        args['uuid'] = str(uuid.uuid4())
+
+def compute_fanout(args):
+    if not args.get('bids') or args.get('data') is None or args.get('dtype') is None:
+        raise exception.ParamValidationError(": bids, data or dtype")
+    args['bids'] = list(dict.fromkeys(args['bids']))
+
 def compute_local(args):
     if args.get('path') is None:
         raise exception.ParamValidationError(": path")
@@ -5,17 +5,52 @@
 """
 
 import abc
+import time
+import uuid
+import heapq
+import queue
 import logging
+import itertools
+import threading
 
 from serving.core import exception
 
+# how often a blocked batcher checks whether it is halted, in seconds
+HALT_POLL = 0.1
+
 
 class Task(metaclass=abc.ABCMeta):
-    def __init__(self, task_id, image_id, extra=''):
+    def __init__(self, task_id, image_id, extra='', payload=None):
         self.task_id = task_id
         self.image_id = image_id
+        # identifies the task while compute processes hold it
+        self.ticket = uuid.uuid4().hex
+        self.retries = 0
+        # set when the main process keeps the task by its ticket for re-queueing
+        self.tracked = False
         self.outlet_id = None
         self.extra = extra
+        self.timestamp = time.time()
+        # compressed image, decoded by the compute process instead of IMAGES_POOL
+        self.payload = payload
+        # decoded frame, only lives inside the compute process
+        self.frame = None
+        # size of image, which is accounted by the task queue
+        self.nbytes = 0
+        # set when a caller waits for the result, instead of outlets
+        self.reply_id = None
+        # set when the result still goes to outlets as well, e.g. of REST requests
+        self.post_outlets = False
+        # larger priority is batched first
+        self.priority = 0
+        # absolute time (in seconds), after which the task is dropped
+        self.deadline = None
+        # tasks of tenants are batched by weighted fair queuing
+        self.tenant = ''
+        # set when the result is kept by the result cache
+        self.cache_key = None
+        # result found in the result cache, such task is never enqueued
+        self.cached = None
 
     def __del__(self):
         #TODO: remove images from memory
@@ -27,3 +62,219 @@ class Task(metaclass=abc.ABCMeta):
 
     def update_outlet(self, outlet_id):
         self.outlet_id = outlet_id
+
+    def expired(self, now=None):
+        if self.deadline is None:
+            return False
+        return (now or time.time()) >= self.deadline
+
+
+class Batcher():
+    """Dynamic Batcher
+
+    Collects tasks from `input_queue` into batches of at most `batchsize`.
+    When `delay` (in seconds) is given, once the oldest collected task has
+    waited for `delay` since it was created, whatever is collected is
+    dispatched as a partial batch. Otherwise, it waits for a full batch.
+
+    Up to `window` tasks (by default twice of `batchsize`, 0 means all queued
+    tasks) are held in one sub-queue per tenant. A batch takes the tasks of
+    highest priority first, then shares among tenants by weighted fair
+    queuing with `weights` (tenant to weight, `*` for the others, by default
+    1), then takes tasks of earliest deadline and in arrival order.
+
+    A `None` put into `input_queue` stops the batcher: it never reads the
+    queue again, and hands out the tasks it holds before it returns `None`.
+    It blocks on the queue while there is nothing to dispatch. `halt` makes
+    it return `None` at once, and leaves the rest of the queue to others.
+
+    With `track`, tasks read from the queue are kept until `take_fresh`, so
+    the owner knows all tasks the batcher holds.
+    """
+    def __init__(self, input_queue, batchsize, delay=None, window=None, weights=None, track=False):
+        self.input_queue = input_queue
+        self.batchsize = batchsize
+        self.delay = delay
+        self.stopped = False
+        self.halted = threading.Event()
+        self.track = track
+        self.fresh = []
+        self.window = 2 * batchsize if window is None else window
+        self.weights = weights or {}
+        self.pools = {}
+        self.vtime = {}
+        self.last_vtime = 0.0
+        self.size = 0
+        self.counter = itertools.count()
+
+    def next_batch(self):
+        """Returns the next batch of tasks, or `None` once stopped and empty
+        """
+        while not self.stopped and not self.halted.is_set():
+            self._drain()
+            if self.stopped or self.size >= self.batchsize:
+                break
+            timeout = HALT_POLL
+            if self.size and self.delay is not None:
+                timeout = self._oldest() + self.delay - time.time()
+                if timeout <= 0:
+                    break
+            try:
+                self._push(self.input_queue.get(timeout=min(timeout, HALT_POLL)))
+            except queue.Empty:
+                pass
+        if not self.size or self.halted.is_set():
+            return None
+        return [self._pop() for _ in range(min(self.batchsize, self.size))]
+
+    def halt(self):
+        """Stops handing out batches, e.g. once its compute process failed,
+        tasks it holds are left to the watchdog
+        """
+        self.halted.set()
+
+    def take_fresh(self):
+        """Returns tasks read from the queue since the last call
+        """
+        fresh, self.fresh = self.fresh, []
+        return fresh
+
+    def _oldest(self):
+        return min([entry[-1].timestamp for pool in self.pools.values() for entry in pool])
+
+    def _push(self, task):
+        if task is None:
+            self.stopped = True
+            return
+        if self.track:
+            self.fresh.append(task)
+        pool = self.pools.setdefault(task.tenant, [])
+        if not pool:
+            # a tenant becoming active catches up with the others
+            self.vtime[task.tenant] = max(self.vtime.get(task.tenant, 0.0), self.last_vtime)
+        deadline = task.deadline if task.deadline is not None else float('inf')
+        heapq.heappush(pool, (-task.priority, deadline, next(self.counter), task))
+        self.size += 1
+
+    def _pop(self):
+        tenant = min([t for t in self.pools if self.pools[t]],
+                     key=lambda t: (self.pools[t][0][0], self.vtime[t]))
+        task = heapq.heappop(self.pools[tenant])[-1]
+        self.last_vtime = self.vtime[tenant]
+        self.vtime[tenant] += 1.0 / self.weights.get(tenant, self.weights.get('*', 1))
+        self.size -= 1
+        if not self.pools[tenant]:
+            del self.pools[tenant]
+        return task
+
+    def _drain(self):
+        # takes whatever is already queued, without waiting
+        while not self.stopped and (self.window == 0 or self.size < self.window):
+            try:
+                self._push(self.input_queue.get_nowait())
+            except queue.Empty:
+                return
+
+
+class Channel():
+    """Channel of batches dispatched to one compute process
+
+    Provides the same `next_batch` and `halt` as `Batcher`, for batches which
+    are formed centrally by the dispatcher of a backend, and stopped by a
+    `None` likewise.
+    """
+    def __init__(self, input_queue):
+        self.input_queue = input_queue
+        self.halted = threading.Event()
+
+    def next_batch(self):
+        """Returns the next dispatched batch, or `None` once stopped or halted
+        """
+        while not self.halted.is_set():
+            try:
+                batch = self.input_queue.get(timeout=HALT_POLL)
+            except queue.Empty:
+                continue
+            if batch is not None and self.halted.is_set():
+                # halted while it was read, left to whoever drains the channel
+                self.input_queue.put(batch)
+                return None
+            return batch
+        return None
+
+    def halt(self):
+        """Stops handing out batches, the rest stay in the channel
+        """
+        self.halted.set()
+
+
+class TokenBucket():
+    """Token Bucket
+
+    Refills `rate` tokens per second, up to `burst` tokens (by default `rate`).
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.stamp = time.time()
+
+    def take(self, count=1):
+        """Takes `count` tokens, returns False if there are not enough
+        """
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+
+class Autoscaler():
+    """Autoscaling Policy
+
+    Decides to add or retire one compute process, keeping between `min_count`
+    and `max_count` of them. The backend scales up while tasks wait in queue
+    for `up_wait` seconds or more, or its processes are busier than
+    `UP_BUSY`, and scales down while the queue is empty and its processes are
+    busy less than `down_busy` of the time. A decision needs `streak`
+    consecutive samples agreeing on it (hysteresis), and comes at least
+    `cooldown` seconds after the previous one.
+    """
+    UP_BUSY = 0.9
+
+    def __init__(self, min_count, max_count, up_wait, down_busy, cooldown, streak=3):
+        self.min_count = min_count
+        self.max_count = max_count
+        self.up_wait = up_wait
+        self.down_busy = down_busy
+        self.cooldown = cooldown
+        self.streak = streak
+        self.ups = 0
+        self.downs = 0
+        self.stamp = 0.0
+
+    def decide(self, count, depth, wait, busy, now=None):
+        """Returns 1 to add a process, -1 to retire one, otherwise 0
+
+        `count` processes are alive, `depth` tasks are queued, tasks waited
+        `wait` seconds in queue and processes were busy `busy` of the time on
+        average since the last sample.
+        """
+        now = now or time.time()
+        if count < self.max_count and depth > 0 and (wait >= self.up_wait or busy >= self.UP_BUSY):
+            self.ups, self.downs = self.ups + 1, 0
+        elif count > self.min_count and depth == 0 and busy <= self.down_busy:
+            self.ups, self.downs = 0, self.downs + 1
+        else:
+            self.ups, self.downs = 0, 0
+        if now - self.stamp < self.cooldown:
+            return 0
+        if self.ups >= self.streak:
+            self.ups, self.stamp = 0, now
+            return 1
+        if self.downs >= self.streak:
+            self.downs, self.stamp = 0, now
+            return -1
+        return 0
@@ -79,6 +79,13 @@ class Backend(be_pb2_grpc.BackendServiceServicer):
         except exception.TruenoException as err:
             return exception.proto_response(c_pb2, "failed to stop backend", err)
 
+    def ReloadModelOnBackend(self, request, context):
+        try:
+            ret = backend.reload_model_on_backend(MessageToDict(request))
+            return ParseDict(ret, c_pb2.ResultReply())
+        except exception.TruenoException as err:
+            return exception.proto_response(c_pb2, "failed to reload backend", err)
+
     # Outlet
     def AppendOutlet(self, request, context):
         try:
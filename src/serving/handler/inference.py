@@ -1,17 +1,23 @@
 import logging
 
+import grpc
 from google.protobuf.json_format import MessageToDict
 
 from serving.core import compute
 from serving.core import exception
 from serving.interface import common_pb2 as c_pb2
+from serving.interface import inference_pb2 as inf_pb2
 from serving.interface import inference_pb2_grpc as inf_pb2_grpc
 
 class Inference(inf_pb2_grpc.InferenceServicer):
     def InferenceLocal(self, request, context):
         try:
-            compute.local_async(MessageToDict(request))
+            compute.local_async(MessageToDict(request, preserving_proto_field_name=True))
             return c_pb2.ResultReply(code=0, msg="")
+        except (exception.BackendOverloadError, exception.FrameStoreExhaustedError) as err:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(err.message)
+            return exception.proto_response(c_pb2, "failed to inference locally", err)
         except exception.TruenoException as err:
             return exception.proto_response(c_pb2, "failed to inference locally", err)
 
@@ -25,8 +31,112 @@ class Inference(inf_pb2_grpc.InferenceServicer):
                 'data': request.data,
                 'extra': request.extra,
                 'dtype': request.dtype,
+                'priority': request.priority,
+                'deadline_ms': request.deadline_ms,
+                'tenant': request.tenant,
             }
             compute.remote_async(pass_in)
             return c_pb2.ResultReply(code=0, msg="")
+        except (exception.BackendOverloadError, exception.FrameStoreExhaustedError) as err:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(err.message)
+            return exception.proto_response(c_pb2, "failed to inference remotely", err)
         except exception.TruenoException as err:
             return exception.proto_response(c_pb2, "failed to inference remotely", err)
+
+    def InferSync(self, request, context):
+        try:
+            pass_in = self._sync_pass_in(request)
+            pass_in['timeout'] = context.time_remaining()
+            result = compute.remote_sync(pass_in)
+            return inf_pb2.InferReply(code=0, msg="", uuid=pass_in['uuid'], result=result)
+        except (exception.BackendOverloadError, exception.FrameStoreExhaustedError) as err:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(err.message)
+            return self._infer_reply(request.uuid, "failed to inference synchronously", err)
+        except exception.InferTimeOutError as err:
+            context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+            context.set_details(err.message)
+            return self._infer_reply(request.uuid, "failed to inference synchronously", err)
+        except exception.TruenoException as err:
+            return self._infer_reply(request.uuid, "failed to inference synchronously", err)
+
+    def InferStream(self, request_iterator, context):
+        requests = (self._sync_pass_in(r) for r in request_iterator)
+        for task_id, result, err in compute.remote_stream(requests, context.is_active):
+            if err is not None:
+                yield self._infer_reply(task_id, "failed to inference in stream", err)
+                continue
+            yield inf_pb2.InferReply(code=0, msg="", uuid=task_id, result=result)
+
+    def InferBatch(self, request, context):
+        try:
+            pass_in = {
+                'bid': request.bid,
+                'items': [self._sync_pass_in(r) for r in request.items],
+                'timeout': context.time_remaining(),
+            }
+            reply_list = []
+            for task_id, result, err in compute.remote_batch(pass_in):
+                if err is not None:
+                    reply_list.append(self._infer_reply(task_id, "failed to inference in batch", err))
+                    continue
+                reply_list.append(inf_pb2.InferReply(code=0, msg="", uuid=task_id, result=result))
+            return inf_pb2.BatchReply(code=0, msg="", items=reply_list)
+        except (exception.BackendOverloadError, exception.FrameStoreExhaustedError) as err:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(err.message)
+            reply = exception.proto_response(c_pb2, "failed to inference in batch", err)
+            return inf_pb2.BatchReply(code=reply.code, msg=reply.msg)
+        except exception.TruenoException as err:
+            reply = exception.proto_response(c_pb2, "failed to inference in batch", err)
+            return inf_pb2.BatchReply(code=reply.code, msg=reply.msg)
+
+    def InferFanout(self, request, context):
+        try:
+            pass_in = {
+                'bids': list(request.bids),
+                'uuid': request.uuid,
+                'data': request.data,
+                'extra': request.extra,
+                'dtype': request.dtype,
+                'priority': request.priority,
+                'deadline_ms': request.deadline_ms,
+                'tenant': request.tenant,
+                'timeout': context.time_remaining(),
+            }
+            reply_list = []
+            for bid, result, err in compute.fanout_sync(pass_in):
+                if err is not None:
+                    reply = self._infer_reply(pass_in['uuid'], "failed to inference on backend", err)
+                    reply.bid = bid
+                    reply_list.append(reply)
+                    continue
+                reply_list.append(inf_pb2.InferReply(code=0, msg="", uuid=pass_in['uuid'], result=result, bid=bid))
+            return inf_pb2.BatchReply(code=0, msg="", items=reply_list)
+        except (exception.BackendOverloadError, exception.FrameStoreExhaustedError) as err:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(err.message)
+            reply = exception.proto_response(c_pb2, "failed to inference in fan-out", err)
+            return inf_pb2.BatchReply(code=reply.code, msg=reply.msg)
+        except exception.TruenoException as err:
+            reply = exception.proto_response(c_pb2, "failed to inference in fan-out", err)
+            return inf_pb2.BatchReply(code=reply.code, msg=reply.msg)
+
+    @staticmethod
+    def _sync_pass_in(request):
+        return {
+            'bid': request.bid,
+            'uuid': request.uuid,
+            'data': request.data,
+            'extra': request.extra,
+            'dtype': request.dtype,
+            'priority': request.priority,
+            'deadline_ms': request.deadline_ms,
+            'tenant': request.tenant,
+        }
+
+    @staticmethod
+    def _infer_reply(task_id, prompt, err):
+        reply = exception.proto_response(c_pb2, prompt, err)
+        return inf_pb2.InferReply(code=reply.code, msg=reply.msg, uuid=task_id or "")
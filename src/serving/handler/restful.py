@@ -1,15 +1,11 @@
-import cv2
 import base64
 import logging
-import threading
-import numpy as np
 from flask import Flask, jsonify, json, request
 
 from serving.core import compute
 from serving.core import exception
 from serving.core.memory import BACKEND, REQUESTS_COUNT
 
-sharelock = threading.Lock()
 app = Flask(__name__)
 
 
@@ -17,34 +13,38 @@ app = Flask(__name__)
 def detect():
     try:
         data = json.loads(str(request.data, encoding="utf-8"))
+        bids = [BACKEND[b].hash() for b in BACKEND]
+        if not bids:
+            return jsonify({"msg": "not model detected"}), 501
         result = {}
-        for b in BACKEND:
-            bhash = BACKEND[b].hash()
-            image = base64.b64decode(data['image'])
-            # image check
-            bytes_as_np_array = np.frombuffer(image, dtype=np.uint8)
-            temp = cv2.imdecode(bytes_as_np_array, cv2.IMREAD_ANYCOLOR)
-            if temp is None:
-                return jsonify({"msg": "image is damaged!"})
-
-            extra_info = data.get('extra', '')
-            sharelock.acquire()
-            logging.error("Lock!")
-            compute.restful_sync({
-                'bid': bhash,
-                'uuid': 'simple',
-                'data': image,
-                'extra': extra_info,
-            })
-            result[bhash] = BACKEND[b].dequeue_result()['simple']
-            sharelock.release()
-            logging.error("Release!")
-        if not result:
-            return 501, jsonify({"msg": "not model detected"})
+        # decoded once and computed by all backends in parallel, results are
+        # exported by outlets too (e.g. syncexporter)
+        for bid, ret, err in compute.fanout_sync({
+                'bids': bids,
+                'data': base64.b64decode(data['image']),
+                'extra': data.get('extra', ''),
+                'dtype': compute.DataType.Encoded.value,
+                'priority': data.get('priority', 0),
+                'deadline_ms': data.get('deadline_ms', 0),
+                'tenant': data.get('tenant', ''),
+                'outlets': True,
+            }):
+            if err is not None:
+                raise err
+            result[bid] = ret
         return jsonify({"result": result})
+    except exception.InferenceDataError as err:
+        logging.warning(err.message)
+        return jsonify({"msg": "image is damaged!"})
     except KeyError as err:
         logging.exception(err)
         return 400, jsonify({"msg": "missing key: {}".format(err)})
+    except (exception.BackendOverloadError, exception.FrameStoreExhaustedError) as err:
+        logging.warning(err.message)
+        return jsonify({"msg": "overloaded: {}".format(err.message)}), 429
+    except exception.InferTimeOutError as err:
+        logging.warning(err.message)
+        return jsonify({"msg": "timeout: {}".format(err.message)}), 504
     except exception.TruenoException as err:
         logging.exception(err)
         return 500, jsonify({"msg": "internal error: {}".format(err)})
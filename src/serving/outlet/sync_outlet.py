@@ -9,4 +9,7 @@ class SyncOutlet(ao.AbstractOutlet):
         self.outlet_object = self.configs['queue']
 
     def post_result(self, task, data):
+        if task.reply_id is not None:
+            # its caller got the result already, nobody dequeues it
+            return
         self.outlet_object.put({task.task_id: data})
@@ -6,15 +6,17 @@
 
 import abc
 import json
-import time
 import logging
 
 from enum import Enum, unique
-from multiprocessing import Process, Value
+from multiprocessing import Event, Process, Value
 
 from serving.core import debug
 from serving.core import config
 
+# seconds to wait for the main loop to exit by itself
+STOP_TIMEOUT = 2
+
 
 class AbstractWork(metaclass=abc.ABCMeta):
     def __init__(self, whash, wtype, configs, links):
@@ -34,6 +36,8 @@ class AbstractWork(metaclass=abc.ABCMeta):
         self.executor = None
         self.executor_sync_state = Value('B', Status.Unknown.value)
         self.executor_sync_state.value = Status.Stop.value
+        # wakes up the main loop to exit
+        self.exit_event = Event()
         self.work_object = None
 
     def __str__(self):
@@ -53,6 +57,7 @@ class AbstractWork(metaclass=abc.ABCMeta):
     @debug.flow("aw.run")
     def run(self):
         self.executor_sync_state.value = Status.Running.value
+        self.exit_event.clear()
         self.executor = Process(
             target=self._main_loop,
             args=(self.executor_sync_state,))
@@ -62,13 +67,15 @@ class AbstractWork(metaclass=abc.ABCMeta):
     @debug.flow("aw.stop")
     def stop(self):
         self.executor_sync_state.value = Status.Exiting.value
-        time.sleep(2) # wait for while-loop exit
+        self.exit_event.set()
         if self.executor is not None:
+            self.executor.join(STOP_TIMEOUT) # wait for while-loop exit
             logging.debug("main-loop proc status: %s, is_alive: %s",
                 self.executor_sync_state.value,
                 self.executor.is_alive())
-            self.executor.terminate()
-            logging.debug("main-loop proc is terminated(%s)", self.executor.is_alive())
+            if self.executor.is_alive():
+                self.executor.terminate()
+                logging.debug("main-loop proc is terminated(%s)", self.executor.is_alive())
             self.executor_sync_state.value = Status.Stop.value
 
     @debug.flow("aw.enable_persist")
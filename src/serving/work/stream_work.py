@@ -4,7 +4,6 @@
   Contact: arthur.r.song@gmail.com
 """
 
-import time
 import uuid
 import logging
 
@@ -35,21 +34,30 @@ class StreamWork(aw.AbstractWork):
             self.work_object.run()
             idx = 1
             while True:
-                if sync_status.value == aw.Status.Exiting.value:
+                if sync_status.value == aw.Status.Exiting.value or self.exit_event.is_set():
                     break
                 logging.debug("steamwork: %s", idx)
                 if not self.work_object.available():
-                    time.sleep(1)
+                    self.exit_event.wait(1)
                     continue
                 frame = self.work_object.frame()
                 img_uuid = str(uuid.uuid4())
-                IMAGES_POOL[img_uuid] = frame
+                try:
+                    IMAGES_POOL[img_uuid] = frame
+                except exception.FrameStoreExhaustedError:
+                    logging.warning("steamwork: frame store is full, drop frame %s", idx)
+                    self.exit_event.wait(self.fps_control)
+                    continue
 
-                backend_instance.enqueue_task(
-                    scheduler.Task(task_id=self.work_hash, image_id=img_uuid),
-                    self.outlet_link)
+                task = scheduler.Task(task_id=self.work_hash, image_id=img_uuid)
+                task.update_outlet(self.outlet_link)
+                task.nbytes = frame.nbytes
+                try:
+                    backend_instance.enqueue_task(task)
+                except exception.BackendOverloadError:
+                    logging.warning("steamwork: backend is overloaded, drop frame %s", idx)
                 #cv2.imwrite('./test-img'+str(idx)+'.jpg', frame)
-                time.sleep(self.fps_control)
+                self.exit_event.wait(self.fps_control)
                 idx = idx + 1
         except Exception as err:
             logging.exception(err)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import signal
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import multiprocessing
+
+import numpy as np
+
+# relocate package, run without the serving package installed
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+os.sep+'../src')
+from serving.core import config
+from serving.core import scheduler
+from serving.core.memory import IMAGES_POOL
+from serving.backend import abstract_backend as ab
+
+
+MODEL = "0123456789abcdef0123456789abcdef"
+PRE_DATAPROCESS = """
+def pre_dataprocess(data):
+    return {'feed_list': [int(data['img'].sum())], 'passby': None}
+"""
+POST_DATAPROCESS = """
+def post_dataprocess(data):
+    return data
+"""
+
+
+class StubBackend(ab.AbstractBackend):
+    """Backend of a model which only tags the sum of each frame
+    """
+    PREFORK = True
+
+    def _load_model(self):
+        self.model_object = {'mhash': self.configs['mhash']}
+        return True
+
+    def _load_parameter(self):
+        pass
+
+    def _infer_data(self, task_list, batchsize):
+        if any([task.task_id == 'crash' and task.retries == 0 for task in task_list]):
+            # crashes the compute process, as a broken model may do
+            os._exit(1)
+        if any([task.task_id == 'raise' for task in task_list]):
+            raise RuntimeError("a failed stage")
+        predp_data = self._preprocess_samples(task_list, batchsize, lambda i, task, frame: {'img': frame})
+        return [{'mhash': self.model_object['mhash'], 'sum': p['feed_list'][0]} for p in predp_data]
+
+
+class QueueOutlet(object):
+    """Outlet which hands results back to the test process
+    """
+    def __init__(self):
+        self.posted = multiprocessing.Queue()
+
+    def post_result(self, task, data):
+        self.posted.put((task.task_id, json.loads(data)['sum']))
+
+
+def _setup_storage():
+    storage = tempfile.mkdtemp()
+    for version in ['1', '2']:
+        path = os.path.join(storage, "models", MODEL, version)
+        os.makedirs(path)
+        for name, content in [("distros.json", json.dumps({'batchsize': 1})),
+                              ("model_dore", ""),
+                              ("pre_dataprocess.py", PRE_DATAPROCESS),
+                              ("post_dataprocess.py", POST_DATAPROCESS)]:
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(content)
+    config.load_configs_from_disk(os.path.dirname(os.path.abspath(__file__))+os.sep+'../src/confs.yaml')
+    config.SYS_CONFIGS['backend']['storage'] = storage
+    config.SYS_CONFIGS['backend']['preheat'] = None
+    return storage
+
+def _new_backend(options):
+    return StubBackend({
+        'btype': 'stub',
+        'batchsize': 1,
+        'cpcount': 2,
+        'mhash': MODEL + "-1",
+        'mcode': "",
+        'mpvtk': "",
+        'configs': json.dumps(options),
+        'outlets': [],
+    })
+
+def _wait_running(backend, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all([s == ab.Status.Running.value for s in backend.report()['cpstatus']]):
+            return
+        time.sleep(0.1)
+    raise RuntimeError("backend is not running: {}".format(backend.report()['cpstatus']))
+
+def _infer(backend, count=4):
+    task_list = []
+    for i in range(count):
+        image_id = str(uuid.uuid4())
+        IMAGES_POOL[image_id] = np.full((2, 2), i, dtype=np.uint8)
+        task_list.append(scheduler.Task("task_{}".format(i), image_id))
+    results = [json.loads(f.result(timeout=20)) for f in backend.submit_tasks(task_list)]
+    if [r['sum'] for r in results] != [4 * i for i in range(count)]:
+        raise RuntimeError("results do not match their tasks: {}".format(results))
+    return set([r['mhash'] for r in results])
+
+def case_run_and_stop(options):
+    print("TEST: --->>> case_run_and_stop", options)
+    backend = _new_backend(options)
+    backend.run()
+    try:
+        _wait_running(backend)
+        if _infer(backend) != set([MODEL + "-1"]):
+            raise RuntimeError("case_run_and_stop infers with a wrong model")
+    finally:
+        start = time.time()
+        backend.stop()
+    if time.time() - start > 5:
+        raise RuntimeError("case_run_and_stop stops slowly: {:.1f}s".format(time.time() - start))
+    if any([p is not None for p in backend.cproc]):
+        raise RuntimeError("case_run_and_stop leaves compute processes")
+
+def case_reload(options):
+    print("TEST: --->>> case_reload", options)
+    backend = _new_backend(options)
+    backend.run()
+    try:
+        _wait_running(backend)
+        _infer(backend)
+        # stream works keep the task queue they were forked with
+        task_queue = backend.task_queue
+        during = []
+        feeder = threading.Thread(target=lambda: during.extend([_infer(backend) for _ in range(10)]))
+        feeder.start()
+        backend.reload({'mhash': MODEL + "-2", 'mcode': "", 'mpvtk': ""})
+        feeder.join()
+        _wait_running(backend)
+        if backend.report()['mhash'] != MODEL + "-2" or backend.task_queue is not task_queue:
+            raise RuntimeError("case_reload does not switch over on the same task queue")
+        if len(during) != 10:
+            raise RuntimeError("case_reload loses tasks queued while swapping")
+        if _infer(backend) != set([MODEL + "-2"]):
+            raise RuntimeError("case_reload infers with the previous model")
+    finally:
+        backend.stop()
+    if any([p is not None for p in backend.cproc]):
+        raise RuntimeError("case_reload leaves compute processes")
+
+def case_outlets(options):
+    print("TEST: --->>> case_outlets", options)
+    backend = _new_backend(options)
+    outlet = QueueOutlet()
+    backend.outlets = [outlet]
+    backend.run()
+    try:
+        _wait_running(backend)
+        task_list = []
+        for i, post_outlets in enumerate([True, False]):
+            image_id = str(uuid.uuid4())
+            IMAGES_POOL[image_id] = np.full((2, 2), i, dtype=np.uint8)
+            task_list.append(scheduler.Task("task_{}".format(i), image_id))
+            task_list[-1].post_outlets = post_outlets
+        for f in backend.submit_tasks(task_list):
+            f.result(timeout=20)
+        # results of waited tasks reach outlets only when asked, as of REST requests
+        if outlet.posted.get(timeout=5) != ("task_0", 0):
+            raise RuntimeError("case_outlets does not post a waited result to outlets")
+        if not outlet.posted.empty():
+            raise RuntimeError("case_outlets posts a result not asked for")
+    finally:
+        backend.stop()
+
+def case_respawn(options):
+    print("TEST: --->>> case_respawn", options)
+    backend = _new_backend(options)
+    backend.run()
+    try:
+        _wait_running(backend)
+        IMAGES_POOL['crash'] = np.full((2, 2), 1, dtype=np.uint8)
+        result = json.loads(backend.submit_task(scheduler.Task('crash', 'crash')).result(timeout=20))
+        if result['sum'] != 4 or sum(backend.cproc_restarts) != 1:
+            raise RuntimeError("case_respawn does not retry on a respawned process")
+        _wait_running(backend)
+        _infer(backend)
+    finally:
+        start = time.time()
+        backend.stop()
+    if time.time() - start > 5:
+        raise RuntimeError("case_respawn stops slowly: {:.1f}s".format(time.time() - start))
+
+def case_pipeline_failure(options):
+    print("TEST: --->>> case_pipeline_failure", options)
+    backend = _new_backend(options)
+    backend.run()
+    try:
+        _wait_running(backend)
+        IMAGES_POOL['raise'] = np.full((2, 2), 1, dtype=np.uint8)
+        result = json.loads(backend.submit_task(scheduler.Task('raise', 'raise')).result(timeout=20))
+        if 'error' not in result:
+            raise RuntimeError("case_pipeline_failure does not fail the batch of a failed stage")
+        # healthy batches after the failure are not aborted by it
+        for _ in range(5):
+            _infer(backend)
+        _wait_running(backend)
+        if sum(backend.cproc_restarts) != 1:
+            raise RuntimeError("case_pipeline_failure does not respawn the failed process")
+    finally:
+        backend.stop()
+
+
+if __name__ == '__main__':
+    print("Running Test:", __file__)
+    storage = _setup_storage()
+    # as run.py, children of the main process are reaped by the kernel
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        for opts in [{'max_batch_delay_ms': 10},
+                     {'max_batch_delay_ms': 10, 'dispatcher': True, 'watchdog': True},
+                     {'max_batch_delay_ms': 10, 'prefork': True, 'watchdog': True}]:
+            case_run_and_stop(opts)
+            case_reload(opts)
+            case_outlets(opts)
+            if opts.get('watchdog'):
+                case_respawn(opts)
+        case_pipeline_failure({'max_batch_delay_ms': 10, 'pipeline': True, 'watchdog': True})
+    finally:
+        IMAGES_POOL.clear()
+        shutil.rmtree(storage)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# relocate package, run without the serving package installed
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+os.sep+'../src')
+from serving.core.cache import ResultCache
+
+
+def case_disabled():
+    print("TEST: --->>> case_disabled")
+    cache = ResultCache()
+    cache.put('k', '{}')
+    if cache.enabled() or cache.get('k') is not None or cache.usage()['misses'] != 0:
+        raise RuntimeError("case_disabled caches with no budget")
+
+def case_key():
+    print("TEST: --->>> case_key")
+    key = ResultCache.key(b'image', 'model', 1)
+    if key != ResultCache.key(b'image', 'model', 1):
+        raise RuntimeError("case_key is not stable")
+    if key == ResultCache.key(b'image', 'model', 2) or key == ResultCache.key(b'other', 'model', 1):
+        raise RuntimeError("case_key does not tell apart payloads or parts")
+
+def case_lru_entries():
+    print("TEST: --->>> case_lru_entries")
+    cache = ResultCache(max_entries=2)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    # a is used more recently than b
+    if cache.get('a') != '1':
+        raise RuntimeError("case_lru_entries misses a cached result")
+    cache.put('c', '3')
+    if cache.get('b') is not None or cache.get('a') != '1' or cache.get('c') != '3':
+        raise RuntimeError("case_lru_entries evicts a recently used entry")
+    usage = cache.usage()
+    if usage['entries'] != 2 or usage['evictions'] != 1 or usage['hits'] != 3 or usage['misses'] != 1:
+        raise RuntimeError("case_lru_entries counts wrong usage: {}".format(usage))
+
+def case_bytes_budget():
+    print("TEST: --->>> case_bytes_budget")
+    cache = ResultCache(max_bytes=10)
+    cache.put('a', 'x' * 4)
+    cache.put('b', 'x' * 4)
+    cache.put('a', 'x' * 6)
+    if cache.usage()['used'] != 10 or cache.get('b') is None:
+        raise RuntimeError("case_bytes_budget accounts a replaced entry: {}".format(cache.usage()))
+    cache.put('c', 'x' * 5)
+    if cache.get('a') is not None or cache.usage()['used'] > 10:
+        raise RuntimeError("case_bytes_budget exceeds its budget: {}".format(cache.usage()))
+    cache.set_budget(1, 0)
+    if cache.usage()['entries'] != 1 or cache.get('c') is None:
+        raise RuntimeError("case_bytes_budget does not evict on a smaller budget")
+
+
+if __name__ == '__main__':
+    print("Running Test:", __file__)
+    case_disabled()
+    case_key()
+    case_lru_entries()
+    case_bytes_budget()
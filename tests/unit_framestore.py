@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import uuid
+
+import numpy as np
+
+# relocate package, run without the serving package installed
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+os.sep+'../src')
+from serving.core import exception
+from serving.core.framestore import FrameStore, HEADER_SIZE
+
+
+def _key():
+    return uuid.uuid4().hex
+
+def case_put_and_get():
+    print("TEST: --->>> case_put_and_get")
+    store = FrameStore()
+    key = _key()
+    frame = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+    store[key] = frame
+    try:
+        view = store[key]
+        if view.shape != frame.shape or view.dtype != frame.dtype or not np.array_equal(view, frame):
+            raise RuntimeError("case_put_and_get returns a different frame")
+        # views are copy-on-write
+        view[...] = 0
+        if not np.array_equal(store[key], frame):
+            raise RuntimeError("case_put_and_get modifies the shared frame")
+        if key not in store or len(store) != 1:
+            raise RuntimeError("case_put_and_get does not count the frame")
+    finally:
+        store.clear()
+
+def case_budget():
+    print("TEST: --->>> case_budget")
+    frame = np.zeros(1024, dtype=np.uint8)
+    store = FrameStore(budget=2 * (HEADER_SIZE + frame.nbytes))
+    keys = [_key() for _ in range(3)]
+    try:
+        store[keys[0]] = frame
+        store[keys[1]] = frame
+        try:
+            store[keys[2]] = frame
+        except exception.FrameStoreExhaustedError:
+            pass
+        else:
+            raise RuntimeError("case_budget admits a frame over budget")
+        if keys[2] in store:
+            raise RuntimeError("case_budget keeps a rejected frame")
+        del store[keys[0]]
+        store[keys[2]] = frame
+        usage = store.usage()
+        if usage['frames'] != 2 or usage['used'] != 2 * (HEADER_SIZE + frame.nbytes):
+            raise RuntimeError("case_budget accounts wrong usage: {}".format(usage))
+    finally:
+        store.clear()
+    if store.usage()['used'] != 0 or store.usage()['frames'] != 0:
+        raise RuntimeError("case_budget leaks usage after clear: {}".format(store.usage()))
+
+def case_refcounts():
+    print("TEST: --->>> case_refcounts")
+    store = FrameStore()
+    key = _key()
+    frame = np.ones((4, 4), dtype=np.float32)
+    store.put(key, frame, refs=3)
+    try:
+        del store[key]
+        popped = store.pop(key)
+        if key not in store:
+            raise RuntimeError("case_refcounts unlinks the frame before the last reference")
+        if not np.array_equal(popped, frame):
+            raise RuntimeError("case_refcounts pops a different frame")
+        del store[key]
+        if key in store or len(store) != 0 or store.usage()['used'] != 0:
+            raise RuntimeError("case_refcounts keeps the frame after the last reference")
+        # a popped view outlives the frame
+        if not np.array_equal(popped, frame):
+            raise RuntimeError("case_refcounts invalidates a popped view")
+        try:
+            del store[key]
+        except KeyError:
+            pass
+        else:
+            raise RuntimeError("case_refcounts deletes a missing frame")
+    finally:
+        store.clear()
+
+def case_invalid_frame():
+    print("TEST: --->>> case_invalid_frame")
+    store = FrameStore()
+    try:
+        store[_key()] = b'not an array'
+    except exception.InferenceDataError:
+        pass
+    else:
+        raise RuntimeError("case_invalid_frame stores a non-array frame")
+    if store.usage()['used'] != 0:
+        raise RuntimeError("case_invalid_frame accounts a rejected frame")
+
+
+if __name__ == '__main__':
+    print("Running Test:", __file__)
+    case_put_and_get()
+    case_budget()
+    case_refcounts()
+    case_invalid_frame()
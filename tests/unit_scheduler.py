@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import queue
+import threading
+
+# relocate package, run without the serving package installed
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+os.sep+'../src')
+from serving.core.scheduler import Autoscaler, Batcher, Channel, Task, TokenBucket
+
+
+def _task(task_id, tenant='', priority=0, deadline=None):
+    task = Task(task_id, None)
+    task.tenant = tenant
+    task.priority = priority
+    task.deadline = deadline
+    return task
+
+def _ids(batch):
+    return [task.task_id for task in batch]
+
+def case_batcher_full_batches():
+    print("TEST: --->>> case_batcher_full_batches")
+    input_queue = queue.Queue()
+    for i in range(5):
+        input_queue.put(_task(str(i)))
+    input_queue.put(None)
+    batcher = Batcher(input_queue, 2)
+    batches = []
+    batch = batcher.next_batch()
+    while batch is not None:
+        batches.append(_ids(batch))
+        batch = batcher.next_batch()
+    if batches != [['0', '1'], ['2', '3'], ['4']]:
+        raise RuntimeError("case_batcher_full_batches returns {}".format(batches))
+
+def case_batcher_delay():
+    print("TEST: --->>> case_batcher_delay")
+    input_queue = queue.Queue()
+    input_queue.put(_task('a'))
+    batcher = Batcher(input_queue, 4, delay=0.05)
+    start = time.time()
+    batch = batcher.next_batch()
+    if _ids(batch) != ['a']:
+        raise RuntimeError("case_batcher_delay returns {}".format(_ids(batch)))
+    if time.time() - start > 1.0:
+        raise RuntimeError("case_batcher_delay does not dispatch a partial batch in time")
+
+def case_batcher_order():
+    print("TEST: --->>> case_batcher_order")
+    input_queue = queue.Queue()
+    now = time.time()
+    input_queue.put(_task('late', deadline=now + 20))
+    input_queue.put(_task('none'))
+    input_queue.put(_task('early', deadline=now + 10))
+    input_queue.put(_task('urgent', priority=1))
+    input_queue.put(None)
+    batch = Batcher(input_queue, 4).next_batch()
+    if _ids(batch) != ['urgent', 'early', 'late', 'none']:
+        raise RuntimeError("case_batcher_order returns {}".format(_ids(batch)))
+
+def case_batcher_fair_queuing():
+    print("TEST: --->>> case_batcher_fair_queuing")
+    input_queue = queue.Queue()
+    for i in range(6):
+        input_queue.put(_task('a%d' % i, tenant='a'))
+    for i in range(3):
+        input_queue.put(_task('b%d' % i, tenant='b'))
+    input_queue.put(None)
+    batch = Batcher(input_queue, 6, window=0, weights={'a': 2}).next_batch()
+    tenants = [task.tenant for task in batch]
+    if tenants.count('a') != 4 or tenants.count('b') != 2:
+        raise RuntimeError("case_batcher_fair_queuing shares {}".format(_ids(batch)))
+
+def case_batcher_window():
+    print("TEST: --->>> case_batcher_window")
+    input_queue = queue.Queue()
+    for i in range(10):
+        input_queue.put(_task(str(i)))
+    batcher = Batcher(input_queue, 2, track=True)
+    batch = batcher.next_batch()
+    fresh = batcher.take_fresh()
+    if _ids(batch) != ['0', '1'] or _ids(fresh) != ['0', '1', '2', '3']:
+        raise RuntimeError("case_batcher_window reads {} for {}".format(_ids(fresh), _ids(batch)))
+    if input_queue.qsize() != 6 or batcher.take_fresh():
+        raise RuntimeError("case_batcher_window reads over its window")
+
+def case_batcher_halt():
+    print("TEST: --->>> case_batcher_halt")
+    input_queue = queue.Queue()
+    for batcher in [Batcher(input_queue, 2), Channel(input_queue)]:
+        batches = []
+        reader = threading.Thread(target=lambda: batches.append(batcher.next_batch()))
+        reader.start()
+        time.sleep(0.2)
+        batcher.halt()
+        reader.join(1.0)
+        if reader.is_alive() or batches != [None]:
+            raise RuntimeError("case_batcher_halt keeps {} blocked".format(batcher))
+        # the rest of the queue is left to others
+        input_queue.put([_task('a')])
+        if batcher.next_batch() is not None or input_queue.qsize() != 1:
+            raise RuntimeError("case_batcher_halt reads the queue after halted")
+        input_queue.get()
+
+def case_token_bucket():
+    print("TEST: --->>> case_token_bucket")
+    bucket = TokenBucket(10, burst=2)
+    if not bucket.take() or not bucket.take() or bucket.take():
+        raise RuntimeError("case_token_bucket does not bound the burst")
+    # refills by elapsed time, up to the burst
+    bucket.stamp -= 0.1
+    if not bucket.take() or bucket.take():
+        raise RuntimeError("case_token_bucket does not refill by rate")
+    bucket.stamp -= 10
+    if not bucket.take(2) or bucket.take():
+        raise RuntimeError("case_token_bucket refills over the burst")
+    if bucket.take(3):
+        raise RuntimeError("case_token_bucket takes more than it holds")
+
+def case_autoscaler():
+    print("TEST: --->>> case_autoscaler")
+    scaler = Autoscaler(1, 3, up_wait=0.1, down_busy=0.2, cooldown=5, streak=3)
+    now = 100.0
+    decisions = [scaler.decide(1, 10, 0.5, 0.5, now=now + i) for i in range(3)]
+    if decisions != [0, 0, 1]:
+        raise RuntimeError("case_autoscaler scales up by {}".format(decisions))
+    # cooldown holds the next decision, hysteresis resets on a disagreeing sample
+    decisions = [scaler.decide(2, 10, 0.5, 0.5, now=now + 3 + i) for i in range(3)]
+    decisions.append(scaler.decide(2, 0, 0.0, 0.5, now=now + 6))
+    if decisions != [0, 0, 0, 0]:
+        raise RuntimeError("case_autoscaler ignores cooldown or hysteresis: {}".format(decisions))
+    decisions = [scaler.decide(2, 0, 0.0, 0.1, now=now + 7 + i) for i in range(3)]
+    if decisions != [0, 0, -1]:
+        raise RuntimeError("case_autoscaler scales down by {}".format(decisions))
+    # bounded by min_count and max_count
+    if any([scaler.decide(3, 10, 1.0, 1.0, now=now + 20 + i) for i in range(5)]):
+        raise RuntimeError("case_autoscaler scales over max_count")
+    if any([scaler.decide(1, 0, 0.0, 0.0, now=now + 30 + i) for i in range(5)]):
+        raise RuntimeError("case_autoscaler scales under min_count")
+
+
+if __name__ == '__main__':
+    print("Running Test:", __file__)
+    case_batcher_full_batches()
+    case_batcher_delay()
+    case_batcher_order()
+    case_batcher_fair_queuing()
+    case_batcher_window()
+    case_batcher_halt()
+    case_token_bucket()
+    case_autoscaler()